@@ -16,3 +16,4 @@ from alhenaloader.load import load_data
 from alhenaloader.load import load_analysis
 from alhenaloader.load import clean_analysis
 from alhenaloader.api import ES
+from alhenaloader.cache import FrameCache
@@ -4,9 +4,19 @@ from elasticsearch.exceptions import NotFoundError
 import ssl
 from elasticsearch.connection import create_ssl_context
 import os
+import functools
+import threading
+import time
+import math
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 import numpy as np
 import click
 
+from alhenaloader.connection import MeteredConnection, TransferStats, SELECTORS, parse_hosts
+import alhenaloader.memory
+import alhenaloader.serialize
+from alhenaloader import profiling
+
 import urllib3
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -33,7 +43,25 @@ DEFAULT_MAPPING = {
     }
 }
 
-FILTERED_LABELS = ['dashboard_type', 'jira_id', 'timestamp']
+CELL_HASHES_MAPPING = {
+    'mappings': {
+        'properties': {
+            'dashboard_id': {'type': 'keyword'},
+            'hashes': {'type': 'object', 'enabled': False},
+        }
+    }
+}
+
+SUMMARY_MAPPING = {
+    'mappings': {
+        'properties': {
+            'dashboard_id': {'type': 'keyword'},
+            'summaries': {'type': 'object', 'enabled': False},
+        }
+    }
+}
+
+FILTERED_LABELS = ['dashboard_type', 'jira_id', 'timestamp', 'load_stats', 'status']
 
 
 class ES(object):
@@ -41,27 +69,59 @@ class ES(object):
 
     ANALYSIS_ENTRY_INDEX = "analyses"
     LABELS_INDEX = "metadata_labels"
+    CELL_HASHES_INDEX = "cell_hashes"
+    SUMMARY_INDEX = "analysis_summaries"
 
-    def __init__(self, host, port):
+    def __init__(self, host, port, maxsize=10, http_compress=False, keep_alive=True, thread_count=4,
+                 sniff=False, selector='round-robin', dead_timeout=60, processes=1, throttle=None):
         """Create a new instance."""
         assert os.environ['ALHENA_ES_USER'] is not None and os.environ[
             'ALHENA_ES_PASSWORD'] is not None, 'Elasticsearch credentials missing'
 
-        ssl_context = create_ssl_context()
-        ssl_context.check_hostname = False
-        ssl_context.verify_mode = ssl.CERT_NONE
+        self.thread_count = thread_count
+        self.processes = processes
+        self.transfer_stats = TransferStats()
+        # MemoryBudget sizing batches of load_df instead of batch_size
+        self.memory_budget = None
 
-        es = Elasticsearch(hosts=[{'host': host, 'port': port}],
+        es = Elasticsearch(hosts=parse_hosts(host, port),
                            http_auth=(os.environ['ALHENA_ES_USER'],
                                       os.environ['ALHENA_ES_PASSWORD']),
                            scheme='https',
                            timeout=300,
-                           ssl_context=ssl_context)
+                           ssl_context=get_ssl_context(),
+                           connection_class=MeteredConnection,
+                           maxsize=maxsize,
+                           http_compress=http_compress,
+                           keep_alive=keep_alive,
+                           transfer_stats=self.transfer_stats,
+                           throttle=throttle,
+                           selector_class=SELECTORS[selector],
+                           dead_timeout=dead_timeout,
+                           sniff_on_start=sniff,
+                           sniff_on_connection_fail=sniff,
+                           sniffer_timeout=60 if sniff else None)
 
         self.es = es
 
+        self.throttle = throttle
+        if throttle is not None and throttle.adaptive:
+            threading.Thread(target=self.monitor_write_queue, daemon=True).start()
+
         # Generic load/delete
 
+    def monitor_write_queue(self, interval=5):
+        """Report deepest write thread pool queue in the cluster to the throttle"""
+        while True:
+            try:
+                response = self.es.cat.thread_pool(thread_pool_patterns='write', h='queue', format='json')
+                self.throttle.observe_queue(max(int(node['queue']) for node in response))
+
+            except Exception as e:
+                click.echo(f'Could not check write queue: {e}')
+
+            time.sleep(interval)
+
     def load_record(self, record, record_id, index, mapping=None):
         """Load individual recoElrd"""
         if not self.es.indices.exists(index):
@@ -70,23 +130,25 @@ class ES(object):
         click.echo(f'Loading record to {index} with id {record_id}')
         self.es.index(index=index, id=record_id, body=record)
 
-    def load_df(self, df, index_name, batch_size=int(1e5)):
-        """Batch load dataframe"""
-        total_records = df.shape[0]
-        num_records = 0
+    def update_record(self, index, record_id, fields):
+        """Merge fields into existing record"""
+        click.echo(f'Updating record in {index} with id {record_id}')
+        self.es.update(index=index, id=record_id, body={'doc': fields}, refresh=True)
 
-        for batch_start_idx in range(0, df.shape[0], batch_size):
-            batch_end_idx = min(batch_start_idx + batch_size, df.shape[0])
-            batch_data = df.loc[df.index[batch_start_idx:batch_end_idx]]
+    def load_df(self, df, index_name, batch_size=int(1e5), mapping=None):
+        """Batch load dataframe, in batches sized by memory_budget if set"""
+        if self.processes > 1:
+            return self.load_df_multiprocess(df, index_name, mapping=mapping)
 
-            clean_fields(batch_data)
+        total_records = df.shape[0]
+        num_records = 0
 
-            records = []
-            for record in batch_data.to_dict(orient='records'):
-                clean_nans(record)
-                records.append(record)
+        for batch_data in alhenaloader.memory.iter_batches(df, batch_size, self.memory_budget):
+            with profiling.phase('serialize'):
+                records = get_records(batch_data)
 
-            self.load_records(records, index_name)
+            with profiling.phase('bulk'):
+                self.load_records(records, index_name, mapping=mapping)
             num_records += batch_data.shape[0]
             click.echo(
                 f"Loading {len(records)} records. Total: {num_records} / {total_records} ({(num_records * 100 / total_records): .1f}%)")
@@ -94,16 +156,73 @@ class ES(object):
             raise ValueError(
                 'mismatch in {num_records} records loaded to {total_records} total records')
 
+    def load_df_multiprocess(self, df, index_name, mapping=None):
+        """Load dataframe with bulk bodies serialized in worker processes"""
+        if not self.es.indices.exists(index_name):
+            self.create_index(index_name, mapping=mapping)
+
+        total_records = df.shape[0]
+        click.echo(f"Loading {total_records} records with {self.processes} processes")
+
+        rows_per_body = alhenaloader.serialize.DEFAULT_ROWS_PER_BODY
+        if self.memory_budget is not None:
+            # Bodies being serialized and sent are held in memory at once
+            in_flight = 2 * self.processes + 2 * self.thread_count
+            rows_per_body = min(rows_per_body, self.memory_budget.get_frame_batch_size(df, in_flight))
+
+        bodies = alhenaloader.serialize.serialize_df(df, index_name, self.processes, rows_per_body=rows_per_body)
+        with profiling.phase('bulk'):
+            num_records = self.load_bulk_bodies(bodies)
+
+        if total_records != num_records:
+            raise ValueError(
+                f'mismatch in {num_records} records loaded to {total_records} total records')
+
     def load_records(self, records, index, mapping=None):
         """Load batch of records"""
         if not self.es.indices.exists(index):
             self.create_index(index, mapping=mapping)
 
-        for success, info in helpers.parallel_bulk(self.es, records, index=index):
+        for success, info in helpers.parallel_bulk(self.es, records, index=index, thread_count=self.thread_count):
             if not success:
                 click.secho('Doc failed in parallel loading', fg="red")
                 click.echo(info)
 
+    def send_bulk(self, body):
+        """Send pre-serialized bulk body, returns number of successful actions"""
+        response = self.es.bulk(body=body)
+
+        if not response['errors']:
+            return len(response['items'])
+
+        num_success = 0
+        for item in response['items']:
+            result = next(iter(item.values()))
+            if 'error' in result:
+                click.secho('Doc failed in bulk loading', fg="red")
+                click.echo(result['error'])
+            else:
+                num_success += 1
+
+        return num_success
+
+    def load_bulk_bodies(self, bodies):
+        """Send pre-serialized bulk bodies in parallel, returns number of successful actions"""
+        num_success = 0
+        with ThreadPoolExecutor(max_workers=self.thread_count) as executor:
+            pending = set()
+            for body in bodies:
+                pending.add(executor.submit(self.send_bulk, body))
+
+                # Bound the number of bodies held in memory
+                if len(pending) >= 2 * self.thread_count:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    num_success += sum(future.result() for future in done)
+
+            num_success += sum(future.result() for future in pending)
+
+        return num_success
+
     def create_index(self, index_name, mapping=None):
         click.echo(f'Creating index with name {index_name}')
 
@@ -113,8 +232,83 @@ class ES(object):
         self.es.indices.create(index=index_name,
                                body=mapping)
 
+    def delete_cells(self, index, cell_ids, batch_size=10000):
+        """Delete all records of cells from index"""
+        if len(cell_ids) == 0 or not self.es.indices.exists(index):
+            return
+
+        # Optimized indices are read-only
+        self.es.indices.put_settings(index=index, body={'index.blocks.write': None})
+
+        for batch_start_idx in range(0, len(cell_ids), batch_size):
+            batch = cell_ids[batch_start_idx:batch_start_idx + batch_size]
+
+            click.echo(f"Deleting records of {len(batch)} cells from {index}")
+            self.es.delete_by_query(index=index, body={
+                "query": {"bool": {"filter": {"terms": {"cell_id": batch}}}}
+            }, refresh=True)
+
+    def get_cell_hashes(self, analysis_id):
+        """Returns per data type cell hashes from the previous load, or None"""
+        try:
+            return self.es.get(index=self.CELL_HASHES_INDEX, id=analysis_id)['_source']['hashes']
+
+        except NotFoundError:
+            return None
+
+    def save_cell_hashes(self, analysis_id, cell_hashes):
+        """Store per data type cell hashes of loaded analysis"""
+        self.load_record({'dashboard_id': analysis_id, 'hashes': cell_hashes}, analysis_id,
+                         self.CELL_HASHES_INDEX, mapping=CELL_HASHES_MAPPING)
+
+    def get_summaries(self, analysis_id):
+        """Returns per data type summaries of loaded analysis, or None"""
+        try:
+            return self.es.get(index=self.SUMMARY_INDEX, id=analysis_id)['_source']['summaries']
+
+        except NotFoundError:
+            return None
+
+    def save_summaries(self, analysis_id, summaries):
+        """Store per data type summaries of loaded analysis"""
+        self.load_record({'dashboard_id': analysis_id, 'summaries': summaries}, analysis_id,
+                         self.SUMMARY_INDEX, mapping=SUMMARY_MAPPING)
+
+    def create_shared_alias(self, shared_index, alias, analysis_id, mapping=None):
+        """Create filtered alias routed by analysis ID on index shared by analyses"""
+        if not self.es.indices.exists(shared_index):
+            click.echo(f'Creating index with name {shared_index}')
+            # Another loader may create the shared index at the same time
+            self.es.indices.create(index=shared_index, body=mapping or DEFAULT_MAPPING,
+                                   ignore=400)
+
+        click.echo(f'Adding alias {alias} to {shared_index}')
+        self.es.indices.put_alias(index=shared_index, name=alias, body={
+            'filter': {'term': {'dashboard_id': analysis_id}},
+            'routing': analysis_id,
+        })
+
+    def get_alias(self, name):
+        """Returns index behind alias and whether the alias is filtered, or None if name is not an alias"""
+        if not self.es.indices.exists_alias(name=name):
+            return None
+
+        index, aliases = next(iter(self.es.indices.get_alias(name=name).items()))
+        return {'index': index, 'filtered': 'filter' in aliases['aliases'][name]}
+
     def delete_index(self, index):
-        if self.es.indices.exists(index):
+        alias = self.get_alias(index)
+
+        if alias is not None and alias['filtered']:
+            click.echo(f"Deleting records and alias {index}")
+            self.es.delete_by_query(index=index, body={'query': {'match_all': {}}}, refresh=True)
+            self.es.indices.delete_alias(index='_all', name=index)
+
+        elif alias is not None:
+            click.echo(f"Deleting index {alias['index']} behind alias {index}")
+            self.es.indices.delete(index=alias['index'], ignore=[400, 404])
+
+        elif self.es.indices.exists(index):
             click.echo(f"Deleting index {index}")
             self.es.indices.delete(index=index, ignore=[400, 404])
 
@@ -148,7 +342,7 @@ class ES(object):
             return True
 
         except NotFoundError:
-            return Fals
+            return False
 
 
     ## Analyses
@@ -210,6 +404,13 @@ class ES(object):
 
         return projects
 
+    def get_analysis_projects(self, analysis_id):
+        """Returns list of projects that include analysis"""
+        response = self.es.security.get_role()
+
+        return [role_name[:-len("_dashboardReader")] for role_name, role in response.items()
+                if role_name.endswith("_dashboardReader") and analysis_id in role["indices"][0]["names"]]
+
     def is_project_exist(self, project):
         """Returns true if project name exists"""
         project_name = f'{project}_dashboardReader'
@@ -323,6 +524,58 @@ class ES(object):
                 })
 
 
+    def sync_projects(self, desired, prune=False, dry_run=False, threads=1):
+        """Make project roles match desired mapping of project names to analysis IDs
+
+        Roles are read once and only projects whose analyses differ are written.
+        With prune, projects missing from desired are removed.
+        """
+        loaded = set(analysis['dashboard_id'] for analysis in self.get_analyses())
+        unloaded_analyses = sorted(set(
+            analysis for analyses in desired.values() for analysis in analyses) - loaded)
+
+        assert len(
+            unloaded_analyses) == 0, f"Analyses are not loaded: {unloaded_analyses}"
+
+        response = self.es.security.get_role()
+        current = {
+            role_name[:-len("_dashboardReader")]: set(role["indices"][0]["names"]) - {self.ANALYSIS_ENTRY_INDEX}
+            for role_name, role in response.items() if role_name.endswith("_dashboardReader")
+        }
+
+        to_put = {
+            project: sorted(set(analyses)) for project, analyses in desired.items()
+            if current.get(project) != set(analyses)
+        }
+        to_delete = sorted(set(current) - set(desired)) if prune else []
+
+        for project, analyses in to_put.items():
+            added = len(set(analyses) - current.get(project, set()))
+            removed = len(current.get(project, set()) - set(analyses))
+            click.echo(f"{'Create' if project not in current else 'Update'} project {project}: +{added} -{removed} analyses")
+
+        for project in to_delete:
+            click.echo(f"Remove project {project}")
+
+        if dry_run:
+            return to_put, to_delete
+
+        def put_project(project, analyses):
+            self.es.security.put_role(name=f'{project}_dashboardReader', body={'indices': [{
+                'names': [self.ANALYSIS_ENTRY_INDEX] + analyses,
+                'privileges': ["read"]
+            }]})
+
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            futures = [executor.submit(put_project, project, analyses) for project, analyses in to_put.items()]
+            futures += [executor.submit(self.remove_project, project) for project in to_delete]
+
+            for future in futures:
+                future.result()
+
+        click.echo(f"Wrote {len(to_put)} projects and removed {len(to_delete)} projects")
+        return to_put, to_delete
+
     ## Veritifcation
     def verify_data(self, delete):
         ## Check for missing data
@@ -340,6 +593,42 @@ class ES(object):
                     self.delete_record_by_id(self.ANALYSIS_ENTRY_INDEX, dashboard_id)
 
 
+    def verify_analyses(self, analysis_ids=None, batch_size=50):
+        """Compare indexed data with statistics recorded at load time, returns problems by analysis ID"""
+        analyses = self.get_analyses()
+        if analysis_ids is not None:
+            analyses = [analysis for analysis in analyses if analysis['dashboard_id'] in analysis_ids]
+
+            missing = set(analysis_ids) - set(analysis['dashboard_id'] for analysis in analyses)
+            assert len(missing) == 0, f"Analyses are not loaded: {sorted(missing)}"
+
+        problems = {analysis['dashboard_id']: [] for analysis in analyses}
+
+        for batch_start_idx in range(0, len(analyses), batch_size):
+            searches = []
+            body = []
+
+            for analysis in analyses[batch_start_idx:batch_start_idx + batch_size]:
+                analysis_id = analysis['dashboard_id']
+                if 'load_stats' not in analysis:
+                    problems[analysis_id].append('no load statistics recorded')
+                    continue
+
+                for data_type, expected in analysis['load_stats'].items():
+                    searches.append((analysis_id, data_type, expected))
+                    body.append({'index': f"{analysis_id.lower()}_{data_type}"})
+                    body.append(get_verify_query(expected))
+
+            if len(body) == 0:
+                continue
+
+            responses = self.es.msearch(body=body)['responses']
+
+            for (analysis_id, data_type, expected), response in zip(searches, responses):
+                problems[analysis_id] += compare_load_stats(data_type, expected, response)
+
+        return problems
+
         ## V1.0.4 analyses
 
     def verify_analyses_v104(self):
@@ -374,6 +663,16 @@ class ES(object):
 
     
 
+@functools.lru_cache(maxsize=None)
+def get_ssl_context():
+    """Return SSL context shared by all connections in this process"""
+    ssl_context = create_ssl_context()
+    ssl_context.check_hostname = False
+    ssl_context.verify_mode = ssl.CERT_NONE
+
+    return ssl_context
+
+
 def get_query_by_analysis_id(analysis_id):
     """Return query that filters by analysis_id"""
     return {
@@ -389,6 +688,53 @@ def get_query_by_analysis_id(analysis_id):
     }
 
 
+def get_records(df):
+    """Return list of cleaned records from dataframe"""
+    clean_fields(df)
+
+    records = df.to_dict(orient='records')
+
+    # Only rows with missing values need their fields checked
+    for row in np.flatnonzero(df.isna().to_numpy().any(axis=1)):
+        clean_nans(records[row])
+
+    return records
+
+
+def get_verify_query(expected):
+    """Return search body with aggregates for load statistics"""
+    aggs = {
+        'cell_ids': {'cardinality': {'field': 'cell_id', 'precision_threshold': 40000}}
+    }
+    for field in expected['sums']:
+        aggs[f'sum_{field}'] = {'sum': {'field': field}}
+
+    return {'size': 0, 'track_total_hits': True, 'aggs': aggs}
+
+
+def compare_load_stats(data_type, expected, response):
+    """Return list of differences between load statistics and search response"""
+    if 'error' in response:
+        return [f"{data_type}: {response['error'].get('type', 'search failed')}"]
+
+    problems = []
+
+    count = response['hits']['total']['value']
+    if count != expected['count']:
+        problems.append(f"{data_type}: {count} documents, expected {expected['count']}")
+
+    cell_ids = response['aggregations']['cell_ids']['value']
+    if cell_ids != expected['cell_ids']:
+        problems.append(f"{data_type}: {cell_ids} cells, expected {expected['cell_ids']}")
+
+    for field, expected_sum in expected['sums'].items():
+        actual_sum = response['aggregations'][f'sum_{field}']['value']
+        if not math.isclose(actual_sum, expected_sum, rel_tol=1e-6, abs_tol=1e-6):
+            problems.append(f"{data_type}: sum of {field} is {actual_sum}, expected {expected_sum}")
+
+    return problems
+
+
 def clean_fields(df):
     """Remove invalid characters from column names"""
     invalid_chars = ['.']
@@ -0,0 +1,232 @@
+import asyncio
+import functools
+import os
+
+import click
+from elasticsearch import AsyncElasticsearch
+from elasticsearch.helpers import async_streaming_bulk
+
+import alhenaloader.load
+from alhenaloader.api import ES, DEFAULT_MAPPING, get_records, get_ssl_context
+from alhenaloader.connection import parse_hosts
+from alhenaloader.throttle import get_bulk_size
+
+
+class AsyncES(object):
+    """Alhena Elasticsearch connection for asyncio loading
+
+    Data is sent through the async client, with at most `concurrency` bulk
+    streams in flight across all indices and analyses loaded by this instance.
+    Analysis records, labels and projects are written through a synchronous
+    ES connection in the default executor.
+    """
+
+    ANALYSIS_ENTRY_INDEX = ES.ANALYSIS_ENTRY_INDEX
+    LABELS_INDEX = ES.LABELS_INDEX
+
+    def __init__(self, host, port, maxsize=10, http_compress=False, concurrency=8, chunk_size=500,
+                 sniff=False, dead_timeout=60, throttle=None, memory_budget=None):
+        """Create a new instance."""
+        assert os.environ['ALHENA_ES_USER'] is not None and os.environ[
+            'ALHENA_ES_PASSWORD'] is not None, 'Elasticsearch credentials missing'
+
+        self.es = AsyncElasticsearch(hosts=parse_hosts(host, port),
+                                     http_auth=(os.environ['ALHENA_ES_USER'],
+                                                os.environ['ALHENA_ES_PASSWORD']),
+                                     scheme='https',
+                                     timeout=300,
+                                     ssl_context=get_ssl_context(),
+                                     maxsize=max(maxsize, concurrency),
+                                     http_compress=http_compress,
+                                     dead_timeout=dead_timeout,
+                                     sniff_on_start=sniff,
+                                     sniff_on_connection_fail=sniff,
+                                     sniffer_timeout=60 if sniff else None)
+        self.sync = ES(host, port, maxsize=maxsize, http_compress=http_compress, sniff=sniff,
+                       dead_timeout=dead_timeout, throttle=throttle)
+        self.throttle = throttle
+        self.memory_budget = memory_budget
+
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+        self._semaphore = None
+        self._index_lock = None
+
+    @property
+    def semaphore(self):
+        # Created lazily so it binds to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    @property
+    def index_lock(self):
+        if self._index_lock is None:
+            self._index_lock = asyncio.Lock()
+        return self._index_lock
+
+    async def close(self):
+        await self.es.close()
+
+    async def run_sync(self, func, *args, **kwargs):
+        """Run blocking call, on synchronous connection or CPU bound, in executor"""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+    async def create_index(self, index_name, mapping=None):
+        click.echo(f'Creating index with name {index_name}')
+
+        if mapping is None:
+            mapping = DEFAULT_MAPPING
+
+        await self.es.indices.create(index=index_name, body=mapping)
+
+    async def ensure_index(self, index, mapping=None):
+        """Create index once, even if many loads to it start together"""
+        async with self.index_lock:
+            if not await self.es.indices.exists(index):
+                await self.create_index(index, mapping=mapping)
+
+    async def load_record(self, record, record_id, index, mapping=None):
+        """Load individual record"""
+        await self.ensure_index(index, mapping=mapping)
+
+        click.echo(f'Loading record to {index} with id {record_id}')
+        await self.es.index(index=index, id=record_id, body=record)
+
+    async def load_df(self, df, index_name, batch_size=int(1e4), mapping=None):
+        """Batch load dataframe, with batches sent concurrently and sized by memory_budget if set"""
+        await self.ensure_index(index_name, mapping=mapping)
+
+        if self.memory_budget is not None:
+            # Up to concurrency batches are turned into records at once
+            batch_size = await self.run_sync(self.memory_budget.get_frame_batch_size, df, self.concurrency)
+
+        total_records = df.shape[0]
+        counts = await asyncio.gather(*[
+            self._load_batch(df, batch_start_idx, min(batch_start_idx + batch_size, total_records), index_name)
+            for batch_start_idx in range(0, total_records, batch_size)
+        ])
+        num_records = sum(counts)
+
+        click.echo(f"Loaded {num_records} / {total_records} records to {index_name}")
+        if total_records != num_records:
+            raise ValueError(
+                f'mismatch in {num_records} records loaded to {total_records} total records')
+
+    async def _load_batch(self, df, batch_start_idx, batch_end_idx, index):
+        # Rows are only sliced and turned into records once a stream is free,
+        # off the event loop so other streams keep sending
+        async with self.semaphore:
+            records = await self.run_sync(get_batch_records, df, batch_start_idx, batch_end_idx)
+
+            return await self._send(records, index)
+
+    async def load_records(self, records, index, mapping=None):
+        """Load batch of records"""
+        await self.ensure_index(index, mapping=mapping)
+
+        async with self.semaphore:
+            return await self._send(records, index)
+
+    async def _send(self, records, index):
+        num_records = 0
+        if self.throttle is not None:
+            records = self._throttled(records, index)
+
+        async for success, info in async_streaming_bulk(self.es, records, index=index,
+                                                        chunk_size=self.chunk_size, raise_on_error=False):
+            if success:
+                num_records += 1
+            else:
+                click.secho('Doc failed in async loading', fg="red")
+                click.echo(info)
+
+        return num_records
+
+    async def _throttled(self, records, index):
+        """Yield records no faster than the throttle's document and byte ceilings allow"""
+        for chunk_start_idx in range(0, len(records), self.chunk_size):
+            chunk = records[chunk_start_idx:chunk_start_idx + self.chunk_size]
+
+            nbytes = 0
+            if self.throttle.bytes is not None:
+                nbytes = await self.run_sync(get_bulk_size, self.es.transport.serializer, chunk, index)
+            await asyncio.sleep(self.throttle.reserve(len(chunk), nbytes))
+
+            for record in chunk:
+                yield record
+
+    async def load_data(self, data, analysis_id, framework, cache=None, cache_key=None, **index_options):
+        """Load dataframes for all data types concurrently, returns load statistics per data type
+
+        Each frame starts loading as soon as it is transformed, while the next
+        data type is transformed, and is released once its statistics are taken.
+        """
+        tasks = {}
+        try:
+            for data_type in alhenaloader.load.GET_DATA:
+                df = await self.run_sync(alhenaloader.load.get_transformed_data, data, data_type, framework,
+                                         cache=cache, cache_key=cache_key)
+
+                df, target = await self.run_sync(alhenaloader.load.prepare_index, df, analysis_id, data_type,
+                                                 **index_options)
+                if target['shared_index'] is not None:
+                    await self.run_sync(self.sync.create_shared_alias, target['shared_index'], target['index'],
+                                        analysis_id, mapping=target['mapping'])
+
+                tasks[data_type] = asyncio.create_task(self.load_frame(df, data_type, target))
+                del df
+
+            results = dict(zip(tasks, await asyncio.gather(*tasks.values())))
+
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            raise
+
+        await self.run_sync(self.sync.save_cell_hashes, analysis_id,
+                            {data_type: result['cell_hashes'] for data_type, result in results.items()})
+        await self.run_sync(self.sync.save_summaries, analysis_id,
+                            {data_type: result['summary'] for data_type, result in results.items()
+                             if result['summary'] is not None})
+
+        return {data_type: result['stats'] for data_type, result in results.items()}
+
+    async def load_frame(self, df, data_type, target):
+        """Load frame of data type, returns its cell hashes, summary and load statistics"""
+        await self.load_df(df, target['index'], mapping=target['mapping'])
+
+        return await self.run_sync(get_frame_stats, df, data_type)
+
+    async def load_analysis(self, analysis_id, data, metadata_record, projects, framework, cache=None, cache_key=None,
+                            **index_options):
+        """Load analysis data, then register the analysis"""
+        stats = await self.load_data(data, analysis_id, framework, cache=cache, cache_key=cache_key, **index_options)
+
+        alhenaloader.load.add_load_stats(metadata_record, stats)
+
+        await self.run_sync(alhenaloader.load.register_analysis, analysis_id, metadata_record, projects, self.sync)
+
+    async def load_analyses(self, analyses):
+        """Load many analyses from one event loop
+
+        `analyses` is a list of keyword argument dicts for load_analysis.
+        """
+        await asyncio.gather(*[self.load_analysis(**analysis) for analysis in analyses])
+
+
+def get_batch_records(df, batch_start_idx, batch_end_idx):
+    """Return records of rows batch_start_idx to batch_end_idx of dataframe"""
+    return get_records(df.iloc[batch_start_idx:batch_end_idx].copy())
+
+
+def get_frame_stats(df, data_type):
+    """Return cell hashes, summary and load statistics of frame"""
+    summarize = alhenaloader.load.SUMMARIES.get(data_type)
+
+    return {
+        'cell_hashes': alhenaloader.load.get_cell_hashes(df),
+        'summary': None if summarize is None else summarize(df),
+        'stats': alhenaloader.load.get_load_stats(df, data_type),
+    }
@@ -0,0 +1,117 @@
+import hashlib
+import os
+
+import click
+import pandas as pd
+
+from alhenaloader.transforms import TRANSFORM_VERSION
+from alhenaloader.version import __version__
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "alhenaloader")
+DEFAULT_CACHE_SIZE = 50 * 1024 ** 3
+
+CACHE_SUFFIX = ".feather"
+
+
+def hash_inputs(directories, framework):
+    """Return key hashing all files in directories, the framework, loader and transform versions"""
+    digest = hashlib.sha256()
+    digest.update(f"{framework}:{__version__}:{TRANSFORM_VERSION}".encode())
+
+    for directory in sorted(set(directories)):
+        for root, dirs, files in os.walk(directory):
+            dirs.sort()
+            for filename in sorted(files):
+                path = os.path.join(root, filename)
+                digest.update(os.path.relpath(path, directory).encode())
+
+                with open(path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b''):
+                        digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+class FrameCache(object):
+    """Local cache of transformed dataframes with LRU eviction"""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_size=DEFAULT_CACHE_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, key, data_type):
+        return os.path.join(self.cache_dir, f"{key}_{data_type}{CACHE_SUFFIX}")
+
+    def has(self, key, data_types):
+        """Returns true if all data types are cached under key"""
+        return all(os.path.exists(self.path(key, data_type)) for data_type in data_types)
+
+    def get(self, key, data_type):
+        """Returns cached dataframe, or None if missing"""
+        path = self.path(key, data_type)
+        if not os.path.exists(path):
+            return None
+
+        click.echo(f'Reading {data_type} from cache')
+        df = pd.read_feather(path)
+
+        # Mark as recently used for eviction
+        os.utime(path)
+        return df
+
+    def put(self, key, data_type, df):
+        """Stores dataframe under key and evicts least recently used entries"""
+        path = self.path(key, data_type)
+        tmp_path = path + ".tmp"
+
+        df.reset_index(drop=True).to_feather(tmp_path)
+        os.replace(tmp_path, path)
+
+        self.evict()
+
+    def entries(self):
+        """Returns list of (path, size, last used) of cached files, oldest first"""
+        entries = []
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith(CACHE_SUFFIX):
+                continue
+
+            path = os.path.join(self.cache_dir, filename)
+            stat = os.stat(path)
+            entries.append((path, stat.st_size, stat.st_mtime))
+
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def evict(self):
+        """Remove least recently used entries until cache fits in max size"""
+        entries = self.entries()
+        total_size = sum(size for path, size, mtime in entries)
+
+        for path, size, mtime in entries:
+            if total_size <= self.max_size:
+                break
+
+            click.echo(f'Evicting {os.path.basename(path)} from cache')
+            os.remove(path)
+            total_size -= size
+
+    def stats(self):
+        """Returns number of entries and total size of cache"""
+        entries = self.entries()
+        return {
+            "entries": len(entries),
+            "size": sum(size for path, size, mtime in entries),
+            "max_size": self.max_size,
+        }
+
+    def purge(self, key=None):
+        """Remove all entries, or only those for key if given"""
+        removed = 0
+        for path, size, mtime in self.entries():
+            if key is None or os.path.basename(path).startswith(f"{key}_"):
+                os.remove(path)
+                removed += 1
+
+        return removed
@@ -20,10 +20,19 @@ It can be used as a handy facility for running the task from a command line.
 """
 from typing import List
 import click
+import yaml
 from scgenome.loaders.qc import load_qc_results
 
 from alhenaloader.api import ES
+from alhenaloader.cache import FrameCache, hash_inputs, DEFAULT_CACHE_DIR
+from alhenaloader.memory import MemoryBudget
+from alhenaloader.throttle import Throttle
 import alhenaloader.load
+import alhenaloader.ndjson
+import alhenaloader.snapshot
+import alhenaloader.reindex
+import alhenaloader.optimize
+from alhenaloader import profiling
 from .__init__ import __version__
 
 
@@ -33,6 +42,15 @@ class Info(object):
     def __init__(self):  # Note: This object must have an empty constructor.
         """Create a new instance."""
         self.verbose: int = 0
+        self.es_options: dict = {}
+        self._es = None
+
+    @property
+    def es(self):
+        """Elasticsearch connection, only created once a command needs it"""
+        if self._es is None:
+            self._es = ES(**self.es_options)
+        return self._es
 
 
 # pass_info is a decorator for functions that pass 'Info' objects.
@@ -43,15 +61,60 @@ pass_info = click.make_pass_decorator(Info, ensure=True)
 # Change the options to below to suit the actual options for your task (or
 # tasks).
 @click.group(chain=True)
-@click.option('--host', default='localhost', help='Hostname for Elasticsearch server')
+@click.option('--host', 'hosts', multiple=True, default=['localhost'],
+              help='Hostname for Elasticsearch server, repeat or comma separate for multiple nodes')
 @click.option('--port', default=9200, help='Port for Elasticsearch server')
+@click.option('--sniff', is_flag=True, help='Discover other nodes in the cluster')
+@click.option('--selector', type=click.Choice(['round-robin', 'least-loaded', 'random']), default='round-robin',
+              help='How requests are spread across nodes')
+@click.option('--dead-timeout', default=60, help='Seconds before retrying a failed node')
+@click.option('--pool-size', default=10, help='Maximum number of connections kept open to Elasticsearch')
+@click.option('--threads', default=4, help='Number of threads sending bulk requests')
+@click.option('--processes', default=1, help='Number of processes serializing documents')
+@click.option('--compress/--no-compress', default=False, help='Gzip compress request bodies')
+@click.option('--keep-alive/--no-keep-alive', default=True, help='Enable TCP keep-alive on connections')
+@click.option('--max-docs-per-sec', type=float, help='Ceiling on documents sent per second')
+@click.option('--max-mb-per-sec', type=float, help='Ceiling on MB of request bodies sent per second')
+@click.option('--adaptive', is_flag=True, help='Lower ceilings while the cluster is slow or its write queue is deep')
 @click.option('--id', help="ID of analysis")
+@click.option('--cache-dir', default=DEFAULT_CACHE_DIR, help='Directory for cache of transformed data')
+@click.option('--cache-size', default=50.0, help='Maximum size of cache in GB')
+@click.option('--profile', 'profile_dir', help='Write per-phase profiles of the run to this directory')
+@click.option('--profile-top', default=20, help='Number of functions in profile summary')
 @pass_info
-def cli(info: Info, host: str, port: int, id: str):
+def cli(info: Info, hosts: List[str], port: int, sniff: bool, selector: str, dead_timeout: int, pool_size: int, threads: int, processes: int, compress: bool, keep_alive: bool,
+        max_docs_per_sec: float, max_mb_per_sec: float, adaptive: bool, id: str,
+        cache_dir: str, cache_size: float, profile_dir: str, profile_top: int):
     """Run alhenaloader."""
 
-    info.es = ES(host, port)
+    info.es_options = {
+        'host': list(hosts),
+        'port': port,
+        'sniff': sniff,
+        'selector': selector,
+        'dead_timeout': dead_timeout,
+        'maxsize': max(pool_size, threads),
+        'http_compress': compress,
+        'keep_alive': keep_alive,
+        'thread_count': threads,
+        'processes': processes,
+    }
+
+    if max_docs_per_sec is not None or max_mb_per_sec is not None:
+        info.es_options['throttle'] = Throttle(
+            docs_per_sec=max_docs_per_sec,
+            bytes_per_sec=None if max_mb_per_sec is None else max_mb_per_sec * 1024 ** 2,
+            adaptive=adaptive)
+    elif adaptive:
+        click.secho("--adaptive needs --max-docs-per-sec or --max-mb-per-sec", fg="yellow")
+
     info.id = id
+    info.cache_dir = cache_dir
+    info.cache_size = int(cache_size * 1024 ** 3)
+
+    if profile_dir is not None:
+        profiling.enable(profile_dir, top=profile_top)
+        click.get_current_context().call_on_close(profiling.write)
 
 
 @cli.command()
@@ -75,8 +138,21 @@ def clean(info: Info):
 @click.option('--sample', required=True, help='Sample ID of analysis')
 @click.option('--description', required=True, help='Description of analysis')
 @click.option('--metadata', 'metadata', multiple=True, help='Additional metadata')
+@click.option('--framework', type=click.Choice(['scp', 'mondrian']), default='scp', help='Pipeline framework that produced results')
+@click.option('--cache', 'use_cache', is_flag=True, help='Reuse and store transformed data in local cache')
+@click.option('--export', 'export_dir', help='Write bulk NDJSON files to this directory instead of loading')
+@click.option('--index-sort/--no-index-sort', default=True, help='Create segs and bins indices sorted by cell and position')
+@click.option('--target-shard-size', default=20.0, help='Target size of each index shard in GB')
+@click.option('--shards', 'shards', multiple=True, help='Fixed number of shards for a data type, as type=number')
+@click.option('--replicas', type=int, help='Number of replicas for each index')
+@click.option('--layout', type=click.Choice(['analysis', 'shared']), default='analysis',
+              help='Indices per analysis, or shared indices per data type with per-analysis aliases')
+@click.option('--bucket', type=click.Choice(['month', 'year']), help='Split shared indices by load time')
+@click.option('--delta', is_flag=True, help='Only reindex cells that changed since the previous load')
+@click.option('--progressive', is_flag=True, help='Make analysis visible once qc is loaded, before segs and bins')
+@click.option('--max-memory', type=float, help='Size load batches to keep the loader within this many GB of memory')
 @pass_info
-def load(info: Info, qc: str, alignment: str, hmmcopy: str, annotation: str, projects: List[str], library: str, sample: str, description: str, metadata: List[str]):
+def load(info: Info, qc: str, alignment: str, hmmcopy: str, annotation: str, projects: List[str], library: str, sample: str, description: str, metadata: List[str], framework: str, use_cache: bool, export_dir: str, index_sort: bool, target_shard_size: float, shards: List[str], replicas: int, layout: str, bucket: str, delta: bool, progressive: bool, max_memory: float):
     """Load records associated with analysis ID in given directories"""
     if info.id is None:
         click.secho("Please specify a analysis ID", fg="yellow")
@@ -89,10 +165,23 @@ def load(info: Info, qc: str, alignment: str, hmmcopy: str, annotation: str, pro
             "Please provide a qc directory or all of annotation, hmmcopy, and alignment directories")
         return
 
-    if qc is not None:
-        data = load_qc_results(qc, qc, qc)
+    directories = [qc] if qc is not None else [alignment, hmmcopy, annotation]
+
+    cache = None
+    cache_key = None
+    if use_cache:
+        cache = FrameCache(info.cache_dir, info.cache_size)
+        cache_key = hash_inputs(directories, framework)
+
+    if cache is not None and cache.has(cache_key, alhenaloader.load.GET_DATA.keys()):
+        click.echo(f'Found cached data for {info.id}')
+        data = None
     else:
-        data = load_qc_results(alignment, hmmcopy, annotation)
+        with profiling.phase('read'):
+            if qc is not None:
+                data = load_qc_results(qc, qc, qc)
+            else:
+                data = load_qc_results(alignment, hmmcopy, annotation)
 
     processed_metadata = {}
     for meta_str in metadata:
@@ -101,8 +190,100 @@ def load(info: Info, qc: str, alignment: str, hmmcopy: str, annotation: str, pro
     analysis_record = alhenaloader.load.process_analysis_entry(
         info.id, library, sample, description, processed_metadata)
 
-    alhenaloader.load.load_analysis(info.id, data, analysis_record, list(projects), info.es)
-    
+    processed_shards = {}
+    for shard_str in shards:
+        [data_type, number_of_shards] = shard_str.split("=")
+        processed_shards[data_type] = int(number_of_shards)
+
+    index_options = {
+        'index_sort': None if index_sort else {},
+        'target_shard_size': int(target_shard_size * 1024 ** 3),
+        'shards': processed_shards,
+        'replicas': replicas,
+        'layout': layout,
+        'bucket': bucket,
+    }
+
+    memory_budget = None
+    if max_memory is not None:
+        memory_budget = MemoryBudget(int(max_memory * 1024 ** 3))
+
+    if export_dir is not None:
+        exporter = alhenaloader.ndjson.BulkExporter(export_dir, memory_budget=memory_budget)
+        alhenaloader.ndjson.export_analysis(info.id, data, analysis_record, list(projects), exporter, framework,
+                                            cache=cache, cache_key=cache_key, **index_options)
+        return
+
+    info.es.memory_budget = memory_budget
+    alhenaloader.load.load_analysis(info.id, data, analysis_record, list(projects), info.es, framework,
+                                    cache=cache, cache_key=cache_key, delta=delta, progressive=progressive,
+                                    **index_options)
+
+
+@cli.command()
+@click.argument('directory')
+@click.option('--chunk-size', default=5000, help='Number of documents per bulk request')
+@pass_info
+def replay(info: Info, directory: str, chunk_size: int):
+    """Load analysis exported with load --export"""
+    alhenaloader.ndjson.replay(directory, info.es, chunk_size=chunk_size)
+
+
+@cli.command()
+@pass_info
+def cache_stats(info: Info):
+    """Show size of local cache"""
+    stats = FrameCache(info.cache_dir, info.cache_size).stats()
+
+    click.echo(f"Cache directory: {info.cache_dir}")
+    click.echo(f"Entries: {stats['entries']}")
+    click.echo(f"Size: {stats['size'] / 1024 ** 3:.2f} GB / {stats['max_size'] / 1024 ** 3:.2f} GB")
+
+
+@cli.command()
+@click.option('--key', help='Only purge entries with this input hash')
+@pass_info
+def cache_purge(info: Info, key: str):
+    """Remove entries from local cache"""
+    removed = FrameCache(info.cache_dir, info.cache_size).purge(key)
+    click.echo(f"Removed {removed} entries from cache")
+
+
+@cli.command()
+@click.argument('directory')
+@click.option('--slices', default=4, help='Number of parallel scroll slices per index')
+@pass_info
+def export(info: Info, directory: str, slices: int):
+    """Export indices, record and projects of analysis ID to directory"""
+    if info.id is None:
+        click.secho("Please specify a analysis ID", fg="yellow")
+        return
+
+    alhenaloader.snapshot.export_snapshot(info.id, directory, info.es, slices=slices)
+
+
+@cli.command(name='import')
+@click.argument('directory')
+@pass_info
+def import_(info: Info, directory: str):
+    """Restore analysis exported with export"""
+    alhenaloader.snapshot.import_snapshot(directory, info.es)
+
+
+@cli.command()
+@click.argument('target_id')
+@click.option('--method', type=click.Choice(['clone', 'reindex']), default='clone',
+              help='Clone indices, or reindex documents into new indices')
+@click.option('--slices', default='auto', help='Number of reindex slices')
+@pass_info
+def copy_analysis(info: Info, target_id: str, method: str, slices: str):
+    """Copy analysis ID to target ID on the server"""
+    if info.id is None:
+        click.secho("Please specify a analysis ID", fg="yellow")
+        return
+
+    alhenaloader.reindex.copy_analysis(info.id, target_id, info.es, method=method, slices=slices)
+
 
 @cli.command()
 @click.argument('project')
@@ -130,6 +311,21 @@ def remove_project(info: Info, project):
     info.es.remove_project(project)
 
 
+@cli.command()
+@click.argument('desired_file')
+@click.option('--prune', is_flag=True, help="Remove projects not in file")
+@click.option('--dry-run', is_flag=True, help="Only show changes")
+@click.option('--parallel', default=1, help="Number of role updates to send at once")
+@pass_info
+def sync_projects(info: Info, desired_file: str, prune: bool, dry_run: bool, parallel: int):
+    """Make projects match YAML/JSON file mapping project names to analysis IDs"""
+    with open(desired_file) as f:
+        desired = yaml.safe_load(f) or {}
+
+    info.es.sync_projects({project: list(analyses or []) for project, analyses in desired.items()},
+                          prune=prune, dry_run=dry_run, threads=parallel)
+
+
 @cli.command()
 @pass_info
 def list_project(info: Info):
@@ -169,6 +365,37 @@ def find_dangling_analyses(info: Info, delete: bool):
 
     
 
+@cli.command()
+@click.option('--analysis', '-a', 'analyses', multiple=True, help="Analysis IDs to verify, defaults to --id or all analyses")
+@pass_info
+def verify(info: Info, analyses: List[str]):
+    """Check loaded data against statistics recorded at load time"""
+    if len(analyses) == 0 and info.id is not None:
+        analyses = [info.id]
+
+    problems = info.es.verify_analyses(list(analyses) if len(analyses) > 0 else None)
+
+    for analysis_id, analysis_problems in problems.items():
+        if len(analysis_problems) == 0:
+            click.echo(f"{analysis_id}: OK")
+        else:
+            click.secho(f"{analysis_id}: {'; '.join(analysis_problems)}", fg="red")
+
+
+@cli.command()
+@click.option('--analysis', '-a', 'analyses', multiple=True, help="Analysis IDs to optimize, defaults to --id or all analyses")
+@click.option('--shrink', is_flag=True, help="Shrink indices to one shard")
+@click.option('--concurrency', default=4, help="Number of indices optimized at once")
+@pass_info
+def optimize(info: Info, analyses: List[str], shrink: bool, concurrency: int):
+    """Force merge loaded analysis indices to one segment and make them read-only"""
+    if len(analyses) == 0 and info.id is not None:
+        analyses = [info.id]
+
+    alhenaloader.optimize.optimize_analyses(info.es, list(analyses) if len(analyses) > 0 else None,
+                                            shrink=shrink, concurrency=concurrency)
+
+
 @cli.command()
 @pass_info
 def initialize(info: Info):
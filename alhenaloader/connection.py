@@ -0,0 +1,137 @@
+import socket
+import threading
+import time
+import urllib.parse
+
+from elasticsearch import Urllib3HttpConnection
+from elasticsearch.connection_pool import ConnectionSelector, RoundRobinSelector, RandomSelector
+from urllib3.connection import HTTPConnection
+
+
+KEEP_ALIVE_SOCKET_OPTIONS = HTTPConnection.default_socket_options + [
+    (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+]
+
+
+class TransferStats(object):
+    """Thread-safe count of request bytes sent to Elasticsearch"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.requests = 0
+        self.raw_bytes = 0
+        self.sent_bytes = 0
+
+    def add(self, raw_bytes, sent_bytes):
+        with self.lock:
+            self.requests += 1
+            self.raw_bytes += raw_bytes
+            self.sent_bytes += sent_bytes
+
+    def summary(self):
+        ratio = self.sent_bytes / self.raw_bytes if self.raw_bytes else 1.0
+        return (f"{self.requests} requests, {self.raw_bytes / 1024 ** 2:.1f} MB of request bodies, "
+                f"{self.sent_bytes / 1024 ** 2:.1f} MB on the wire ({ratio * 100:.0f}%)")
+
+
+class MeteredConnection(Urllib3HttpConnection):
+    """Connection that counts bytes sent and can enable TCP keep-alive"""
+
+    def __init__(self, *args, transfer_stats=None, keep_alive=True, throttle=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.transfer_stats = transfer_stats
+        self.throttle = throttle
+
+        if keep_alive:
+            self.pool.conn_kw['socket_options'] = KEEP_ALIVE_SOCKET_OPTIONS
+
+        self._local = threading.local()
+
+    def _gzip_compress(self, body):
+        compressed = super()._gzip_compress(body)
+        self._local.sent_bytes = len(compressed)
+        return compressed
+
+    def perform_request(self, method, url, params=None, body=None, *args, **kwargs):
+        self._local.sent_bytes = None
+
+        is_bulk = self.throttle is not None and body and url.endswith('_bulk')
+        if is_bulk:
+            # Each indexed document is an action line and a source line
+            self.throttle.wait(body.count(b'\n') // 2, len(body))
+
+        start = time.monotonic()
+        try:
+            return super().perform_request(method, url, params, body, *args, **kwargs)
+        finally:
+            if is_bulk:
+                self.throttle.observe_latency(time.monotonic() - start)
+
+            if self.transfer_stats is not None and body:
+                sent_bytes = self._local.sent_bytes
+                self.transfer_stats.add(len(body), len(body) if sent_bytes is None else sent_bytes)
+
+
+class LeastLoadedSelector(ConnectionSelector):
+    """Select the live connection with the most idle pooled HTTP connections"""
+
+    def select(self, connections):
+        return max(connections, key=idle_connections)
+
+
+def idle_connections(connection):
+    pool = getattr(connection, 'pool', None)
+    if pool is None or pool.pool is None:
+        return 0
+    return pool.pool.qsize()
+
+
+SELECTORS = {
+    'round-robin': RoundRobinSelector,
+    'least-loaded': LeastLoadedSelector,
+    'random': RandomSelector,
+}
+
+
+def parse_hosts(hosts, port):
+    """Return host dicts from host names, comma lists, host:port, [IPv6]:port or https:// URLs"""
+    if isinstance(hosts, str):
+        hosts = [hosts]
+
+    parsed = []
+    for host_str in hosts:
+        for host in host_str.split(','):
+            host = host.strip()
+            if host:
+                parsed.append(parse_host(host, port))
+
+    assert len(parsed) > 0, 'No Elasticsearch hosts given'
+    return parsed
+
+
+def parse_host(host, port):
+    """Return host dict for one host, with port if it does not give one"""
+    if '://' not in host and host.count(':') > 1 and not host.startswith('['):
+        # Unbracketed IPv6 address, which cannot have a port
+        return {'host': host, 'port': port}
+
+    url = urllib.parse.urlsplit(host if '://' in host else f'//{host}')
+
+    # Connections always use https
+    if url.scheme not in ('', 'https'):
+        raise Exception(f"Unsupported scheme in host '{host}', expected https or no scheme")
+    if url.path not in ('', '/') or url.query or url.fragment or url.username:
+        raise Exception(f"Unexpected path, query or credentials in host '{host}'")
+
+    try:
+        host_port = url.port
+    except ValueError:
+        raise Exception(f"Invalid port in host '{host}'")
+
+    if not url.hostname:
+        raise Exception(f"No host name in '{host}'")
+
+    return {'host': url.hostname, 'port': port if host_port is None else host_port}
@@ -1,17 +1,74 @@
+import numpy as np
 import pandas as pd
+import copy
 import datetime
+import json
+import math
+import click
 
+from alhenaloader.api import DEFAULT_MAPPING, get_records
+from alhenaloader import profiling
+from alhenaloader.transforms import apply_transforms, Rename, Ratio, Remap, BoolToKeyword
 
-def load_analysis(analysis_id, data, metadata_record, projects, es, framework):
-    load_data(data, analysis_id, es, framework)
+# Estimated from JSON documents, which is close to the size on disk before compression
+DEFAULT_TARGET_SHARD_SIZE = 20 * 1024 ** 3
+
+
+def load_analysis(analysis_id, data, metadata_record, projects, es, framework, cache=None, cache_key=None,
+                  delta=False, progressive=False, **index_options):
+    es.transfer_stats.reset()
+
+    if progressive:
+        load_analysis_progressive(analysis_id, data, metadata_record, projects, es, framework, cache=cache,
+                                  cache_key=cache_key, delta=delta, **index_options)
 
-    if framework == 'scp':
-        metadata_record['cell_count'] = data['annotation_metrics'].shape[0]
-    elif framework == 'mondrian':
-        metadata_record['cell_count'] = data['hmmcopy_metrics'].shape[0]
     else:
-        raise Exception(f"Unknown framework, expected 'scp' or 'mondrian', but got '{framework}'")
+        stats = load_data(data, analysis_id, es, framework, cache=cache, cache_key=cache_key, delta=delta,
+                          **index_options)
+
+        add_load_stats(metadata_record, stats)
+
+        register_analysis(analysis_id, metadata_record, projects, es)
+
+    click.echo(f'Transferred for {analysis_id}: {es.transfer_stats.summary()}')
+
+
+def load_analysis_progressive(analysis_id, data, metadata_record, projects, es, framework, cache=None,
+                              cache_key=None, delta=False, **index_options):
+    """Load small data types, make analysis visible, then load the rest updating its status"""
+    first_data_types = [data_type for data_type in GET_DATA if data_type in PROGRESSIVE_FIRST]
+    stats = load_data(data, analysis_id, es, framework, cache=cache, cache_key=cache_key, delta=delta,
+                      data_types=first_data_types, **index_options)
+
+    add_load_stats(metadata_record, stats)
+    metadata_record['status'] = {
+        data_type: 'ready' if data_type in stats else 'loading' for data_type in GET_DATA
+    }
+
+    register_analysis(analysis_id, metadata_record, projects, es)
+
+    for data_type in GET_DATA:
+        if data_type in stats:
+            continue
+
+        stats.update(load_data(data, analysis_id, es, framework, cache=cache, cache_key=cache_key, delta=delta,
+                               data_types=[data_type], **index_options))
 
+        click.echo(f'{data_type} is ready for {analysis_id}')
+        es.update_record(es.ANALYSIS_ENTRY_INDEX, analysis_id, {
+            'status': {data_type: 'ready'},
+            'load_stats': {data_type: stats[data_type]},
+        })
+
+
+def add_load_stats(metadata_record, stats):
+    """Add cell count and per data type load statistics to analysis record"""
+    metadata_record['cell_count'] = stats['qc']['count']
+    metadata_record['load_stats'] = stats
+
+
+def register_analysis(analysis_id, metadata_record, projects, es):
+    """Load analysis record, add any new labels and add analysis to projects"""
     es.load_record(metadata_record, analysis_id, es.ANALYSIS_ENTRY_INDEX)
 
     missing_labels = es.get_missing_labels()
@@ -28,6 +85,10 @@ def clean_analysis(analysis_id, es):
 
     es.remove_analysis_from_projects(analysis_id)
 
+    es.delete_record_by_id(es.CELL_HASHES_INDEX, analysis_id)
+
+    es.delete_record_by_id(es.SUMMARY_INDEX, analysis_id)
+
 def clean_data(analysis_id, es):
     for data_type, get_data in GET_DATA.items():
         es.delete_index(f"{analysis_id.lower()}_{data_type}")
@@ -53,53 +114,339 @@ def load_analysis_entry(analysis_id, library_id, sample_id, description, metadat
     es.load_record(record, analysis_id, es.ANALYSIS_ENTRY_INDEX)
 
 
-def load_data(data, analysis_id, es, framework):
-    """Load dataframes"""
+def load_data(data, analysis_id, es, framework, cache=None, cache_key=None, delta=False, data_types=None,
+              **index_options):
+    """Load dataframes, returns load statistics per data type
 
-    for data_type, get_data in GET_DATA.items():
-        df = get_data(data, framework)
-        es.load_df(df, f"{analysis_id.lower()}_{data_type}")
+    Only data_types are loaded if given. With delta, only cells whose rows
+    changed since the previous load are deleted and reindexed. index_options
+    are passed to prepare_index.
+    """
+    stats = {}
+    previous_hashes = es.get_cell_hashes(analysis_id) if delta or data_types is not None else None
+    # Hashes and summaries of data types not loaded now are kept
+    cell_hashes = {} if data_types is None else dict(previous_hashes or {})
+    summaries = {} if data_types is None else dict(es.get_summaries(analysis_id) or {})
 
+    for data_type in GET_DATA if data_types is None else data_types:
+        df = get_transformed_data(data, data_type, framework, cache=cache, cache_key=cache_key)
 
-def get_qc_data(hmmcopy_data, framework=None):
-    if framework == 'scp':
-        data = hmmcopy_data['annotation_metrics']
-    elif framework == 'mondrian':
-        data = hmmcopy_data['hmmcopy_metrics']
-        data.rename(columns={'clustering_order': 'order', 'condition': 'experimental_condition'}, inplace=True)
+        df, target = prepare_index(df, analysis_id, data_type, **index_options)
+        cell_hashes[data_type] = get_cell_hashes(df)
+
+        previous = None if previous_hashes is None else previous_hashes.get(data_type)
+        if delta and previous is not None:
+            changed_cells = [cell_id for cell_id, cell_hash in cell_hashes[data_type].items()
+                             if previous.get(cell_id) != cell_hash]
+            removed_cells = [cell_id for cell_id in previous if cell_id not in cell_hashes[data_type]]
+
+            click.echo(f'{data_type}: {len(changed_cells)} changed and {len(removed_cells)} removed cells')
+            es.delete_cells(target['index'], changed_cells + removed_cells)
+            es.load_df(df[df['cell_id'].isin(changed_cells)], target['index'], mapping=target['mapping'])
+
+        else:
+            if delta:
+                click.echo(f'{data_type}: no previous cell hashes, reloading all cells')
+                es.delete_index(target['index'])
+
+            if target['shared_index'] is not None:
+                es.create_shared_alias(target['shared_index'], target['index'], analysis_id, mapping=target['mapping'])
+
+            es.load_df(df, target['index'], mapping=target['mapping'])
+
+        stats[data_type] = get_load_stats(df, data_type)
+        if data_type in SUMMARIES:
+            summaries[data_type] = SUMMARIES[data_type](df)
+
+    es.save_cell_hashes(analysis_id, cell_hashes)
+    es.save_summaries(analysis_id, summaries)
+
+    return stats
+
+
+def get_cell_hashes(df):
+    """Return hash of the rows of each cell, independent of row order"""
+    if df.shape[0] == 0:
+        return {}
+
+    row_hashes = pd.util.hash_pandas_object(get_canonical_frame(df), index=False).to_numpy()
+    cells = df['cell_id'].astype('category')
+    codes = cells.cat.codes.to_numpy()
+
+    order = np.argsort(codes, kind='stable')
+    sorted_codes = codes[order]
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+
+    # Sums of row hashes wrap around in uint64
+    cell_sums = np.add.reduceat(row_hashes[order], starts)
+
+    return {
+        str(cells.cat.categories[code]): format(int(cell_sum), '016x')
+        for code, cell_sum in zip(sorted_codes[starts], cell_sums) if code >= 0
+    }
+
+
+def get_canonical_frame(df):
+    """Return view of dataframe with dtypes that do not depend on compact_dtypes
+
+    Hashes are of the bytes of each value, and compact_dtypes picks dtypes from
+    the values of the whole frame, so values are hashed as 64 bit numbers.
+    """
+    columns = {}
+    for col in df.columns:
+        series = df[col]
+
+        if pd.api.types.is_bool_dtype(series.dtype):
+            columns[col] = series
+        elif pd.api.types.is_integer_dtype(series.dtype):
+            columns[col] = series.astype(np.int64)
+        elif pd.api.types.is_float_dtype(series.dtype):
+            columns[col] = series.astype(np.float64)
+        else:
+            # Categoricals are hashed by their values, not their codes
+            columns[col] = series
+
+    return pd.DataFrame(columns, index=df.index)
+
+
+def prepare_index(df, analysis_id, data_type, index_sort=None, target_shard_size=DEFAULT_TARGET_SHARD_SIZE,
+                  shards=None, replicas=None, layout='analysis', bucket=None):
+    """Return dataframe sorted for its index, and where and how to index it
+
+    index_sort overrides INDEX_SORT, the fields each data type's index is sorted by.
+    shards maps data types to a fixed number of shards, otherwise shards are sized
+    from the estimated indexed size of the dataframe and target_shard_size.
+
+    With the 'shared' layout, documents go to one index per data type (and per
+    bucket of time if given) through a filtered alias routed by analysis ID, named
+    like the index of the 'analysis' layout.
+    """
+    sort_fields = get_sort_fields(df, data_type, index_sort)
+    df = sort_for_index(df, sort_fields)
+
+    if shards is not None and data_type in shards:
+        number_of_shards = shards[data_type]
+    elif layout == 'shared':
+        number_of_shards = DEFAULT_SHARED_SHARDS
     else:
+        number_of_shards = get_number_of_shards(df, target_shard_size)
+
+    settings = {'number_of_shards': number_of_shards}
+    if replicas is not None:
+        settings['number_of_replicas'] = replicas
+
+    mapping = get_index_mapping(sort_fields, settings)
+    shared_index = None
+
+    if layout == 'shared':
+        shared_index = get_shared_index_name(data_type, bucket)
+        mapping['mappings']['_routing'] = {'required': True}
+        mapping['mappings'].setdefault('properties', {})['dashboard_id'] = {'type': 'keyword'}
+
+        df = df.assign(dashboard_id=pd.Categorical.from_codes(np.zeros(df.shape[0], dtype=np.int8), [analysis_id]))
+    elif layout != 'analysis':
+        raise Exception(f"Unknown layout, expected 'analysis' or 'shared', but got '{layout}'")
+
+    return df, {
+        'index': f"{analysis_id.lower()}_{data_type}",
+        'mapping': mapping,
+        'shared_index': shared_index,
+    }
+
+
+def get_shared_index_name(data_type, bucket=None):
+    """Return name of index shared by all analyses of data type, optionally bucketed by load time"""
+    if bucket is None:
+        return f"{SHARED_INDEX_PREFIX}{data_type}"
+
+    return f"{SHARED_INDEX_PREFIX}{data_type}-{datetime.datetime.now().strftime(BUCKET_FORMATS[bucket])}"
+
+
+def get_number_of_shards(df, target_shard_size=DEFAULT_TARGET_SHARD_SIZE, sample_size=1000):
+    """Return number of shards so that each holds about target_shard_size bytes"""
+    if df.shape[0] == 0:
+        return 1
+
+    sample = df.head(sample_size).copy()
+    sample_bytes = sum(len(json.dumps(record, default=str)) for record in get_records(sample))
+    estimated_bytes = sample_bytes / sample.shape[0] * df.shape[0]
+
+    return max(1, int(math.ceil(estimated_bytes / target_shard_size)))
+
+
+def get_sort_fields(df, data_type, index_sort=None):
+    """Return list of (field, type) to sort index of data type by"""
+    if index_sort is None:
+        index_sort = INDEX_SORT
+
+    return [(field, field_type) for field, field_type in index_sort.get(data_type, []) if field in df.columns]
+
+
+def sort_for_index(df, sort_fields):
+    """Sort dataframe in index sort order, so documents arrive at Elasticsearch presorted"""
+    if len(sort_fields) == 0:
+        return df
+
+    return df.sort_values([field for field, field_type in sort_fields], kind='mergesort')
+
+
+def get_index_mapping(sort_fields, settings=None):
+    """Return index mapping with index settings and index sorting on sort fields"""
+    mapping = copy.deepcopy(DEFAULT_MAPPING)
+    mapping['settings']['index'].update(settings or {})
+
+    if len(sort_fields) == 0:
+        return mapping
+
+    mapping['settings']['index']['sort.field'] = [field for field, field_type in sort_fields]
+    mapping['settings']['index']['sort.order'] = ['asc'] * len(sort_fields)
+    # Sort fields must be mapped when the index is created
+    mapping['mappings']['properties'] = {
+        field: {'type': field_type} for field, field_type in sort_fields
+    }
+
+    return mapping
+
+
+def get_load_stats(df, data_type):
+    """Return record count, distinct cell count and column sums used to verify a load"""
+    return {
+        'count': int(df.shape[0]),
+        'cell_ids': int(df['cell_id'].nunique()),
+        'sums': {
+            field: float(np.nansum(df[field].to_numpy(dtype=np.float64)))
+            for field in VERIFY_SUMS[data_type] if field in df.columns
+        },
+    }
+
+
+def get_qc_summary(df):
+    """Return cell count, histogram of cell quality and number of cells per modal state"""
+    summary = {'cell_count': int(df['cell_id'].nunique())}
+
+    if 'quality' in df.columns:
+        quality = df['quality'].to_numpy(dtype=np.float64)
+        counts, edges = np.histogram(quality[~np.isnan(quality)], bins=QUALITY_HISTOGRAM_BINS, range=(0, 1))
+        summary['quality_histogram'] = {
+            'edges': [round(float(edge), 4) for edge in edges],
+            'counts': [int(count) for count in counts],
+        }
+
+    if 'state_mode' in df.columns:
+        state_counts = df['state_mode'].value_counts()
+        summary['state_mode_counts'] = {str(state): int(count) for state, count in state_counts.items()}
+
+    return summary
+
+
+def get_bins_summary(df):
+    """Return mean copy number per chromosome"""
+    if 'copy' not in df.columns:
+        return {}
+
+    copy_number = df['copy'].astype(np.float64)
+    mean_copy = copy_number.groupby(df['chrom_number'], observed=True).mean().dropna()
+
+    return {'mean_copy': {str(chrom): float(mean) for chrom, mean in mean_copy.items()}}
+
+
+def get_transformed_data(data, data_type, framework, cache=None, cache_key=None):
+    """Return transformed dataframe for data type, reading from cache if given"""
+    if cache is not None:
+        df = cache.get(cache_key, data_type)
+        if df is not None:
+            return df
+
+    with profiling.phase(f'transform_{data_type}'):
+        df = compact_dtypes(GET_DATA[data_type](data, framework))
+
+    if cache is not None:
+        cache.put(cache_key, data_type, df)
+
+    return df
+
+
+def get_qc_data(hmmcopy_data, framework=None):
+    if framework not in QC_SOURCES:
         raise Exception(f"Unknown framework, expected 'scp' or 'mondrian', but got '{framework}'")
 
-    data['percent_unmapped_reads'] = data["unmapped_reads"] / data["total_reads"]
-    data['is_contaminated'] = data['is_contaminated'].apply(
-        lambda a: {True: 'true', False: 'false'}[a])
-    return data
+    data = hmmcopy_data[QC_SOURCES[framework]]
+    return apply_transforms(data, QC_TRANSFORMS[framework])
 
 
 def get_segs_data(hmmcopy_data, framework=None):
-    data = hmmcopy_data['hmmcopy_segs'].copy()
-    data['chrom_number'] = create_chrom_number(data['chr'])
-    return data
+    return apply_transforms(hmmcopy_data['hmmcopy_segs'], CHROM_TRANSFORMS)
 
 
 def get_bins_data(hmmcopy_data, framework=None):
-    data = hmmcopy_data['hmmcopy_reads'].copy()
-    data['chrom_number'] = create_chrom_number(data['chr'])
-    return data
+    return apply_transforms(hmmcopy_data['hmmcopy_reads'], CHROM_TRANSFORMS)
 
 
 def get_gc_bias_data(hmmcopy_data, framework=None):
     data = hmmcopy_data['gc_metrics']
 
-    gc_cols = list(range(101))
-    gc_bias_df = pd.DataFrame(columns=['cell_id', 'gc_percent', 'value'])
-    for n in gc_cols:
-        new_df = data.loc[:, ['cell_id', str(n)]]
-        new_df.columns = ['cell_id', 'value']
-        new_df['gc_percent'] = n
-        gc_bias_df = gc_bias_df.append(new_df, ignore_index=True)
+    gc_cols = [str(n) for n in range(101)]
+    gc_bias_df = data.melt(id_vars=['cell_id'], value_vars=gc_cols, var_name='gc_percent', value_name='value')
+    gc_bias_df['gc_percent'] = gc_bias_df['gc_percent'].astype(np.int64)
+
+    return gc_bias_df[['cell_id', 'gc_percent', 'value']]
+
+
+def compact_dtypes(df):
+    """Store repeated strings as categoricals and downcast numeric columns where lossless"""
+    memory_before = df.memory_usage(deep=True).sum()
+
+    for col in df.columns:
+        series = df[col]
 
-    return gc_bias_df
+        if col in CATEGORICAL_COLUMNS and pd.api.types.is_string_dtype(series.dtype):
+            df[col] = series.astype('category')
+
+        elif pd.api.types.is_integer_dtype(series.dtype):
+            df[col] = pd.to_numeric(series, downcast='integer')
+
+        elif pd.api.types.is_float_dtype(series.dtype) and series.dtype != np.float32:
+            downcast = series.astype(np.float32)
+            if np.array_equal(downcast.to_numpy(dtype=np.float64), series.to_numpy(), equal_nan=True):
+                df[col] = downcast
+
+    memory_after = df.memory_usage(deep=True).sum()
+    click.echo(f'Compacted dataframe from {memory_before / 1024 ** 2:.1f} MB to {memory_after / 1024 ** 2:.1f} MB')
+
+    return df
+
+
+CATEGORICAL_COLUMNS = ['cell_id', 'chr', 'chrom_number']
+
+SHARED_INDEX_PREFIX = "alhena_"
+DEFAULT_SHARED_SHARDS = 5
+BUCKET_FORMATS = {
+    'month': '%Y.%m',
+    'year': '%Y',
+}
+
+# Small data types loaded before the analysis is made visible in progressive loads
+PROGRESSIVE_FIRST = ['qc', 'gc_bias']
+
+INDEX_SORT = {
+    'segs': [('cell_id', 'keyword'), ('chrom_number', 'keyword'), ('start', 'long')],
+    'bins': [('cell_id', 'keyword'), ('chrom_number', 'keyword'), ('start', 'long')],
+}
+
+VERIFY_SUMS = {
+    'qc': ['total_reads'],
+    'segs': ['state'],
+    'bins': ['copy', 'state'],
+    'gc_bias': ['value'],
+}
+
+QUALITY_HISTOGRAM_BINS = 20
+
+# Summaries stored per analysis, so dashboards do not aggregate over the data indices
+SUMMARIES = {
+    'qc': get_qc_summary,
+    'bins': get_bins_summary,
+}
 
 
 GET_DATA = {
@@ -113,6 +460,23 @@ GET_DATA = {
 chr_prefixed = {str(a): '0' + str(a) for a in range(1, 10)}
 
 
-def create_chrom_number(chromosomes):
-    chrom_number = chromosomes.map(lambda a: chr_prefixed.get(a, a))
-    return chrom_number
+QC_SOURCES = {
+    'scp': 'annotation_metrics',
+    'mondrian': 'hmmcopy_metrics',
+}
+
+QC_TRANSFORMS = {
+    'scp': [
+        Ratio('percent_unmapped_reads', 'unmapped_reads', 'total_reads'),
+        BoolToKeyword('is_contaminated'),
+    ],
+    'mondrian': [
+        Rename({'clustering_order': 'order', 'condition': 'experimental_condition'}),
+        Ratio('percent_unmapped_reads', 'unmapped_reads', 'total_reads'),
+        BoolToKeyword('is_contaminated'),
+    ],
+}
+
+CHROM_TRANSFORMS = [
+    Remap('chr', chr_prefixed, name='chrom_number'),
+]
@@ -0,0 +1,127 @@
+import gc
+import os
+import resource
+import sys
+
+import click
+
+import alhenaloader.api
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def get_rss():
+    """Return resident set size of this process in bytes"""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+    except (OSError, ValueError):
+        # Peak rather than current size, in KB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def get_record_size(record):
+    """Return approximate bytes held by record dict, not counting its shared keys"""
+    return sys.getsizeof(record) + sum(sys.getsizeof(value) for value in record.values())
+
+
+class MemoryBudget(object):
+    """Sizes load batches so the process stays within max_bytes of memory
+
+    Batches are sized from the measured cost of a row of each dataframe once
+    turned into records, and from the headroom under the budget when loading
+    of the dataframe starts. RSS rarely shrinks once allocated, so batches
+    are only halved once the process nears the budget during a load.
+    """
+
+    # Fraction of headroom a batch of records may use, the rest is left
+    # for bulk request bodies and copies made while indexing
+    BATCH_FRACTION = 0.5
+    # Fraction of the budget above which batches are halved
+    HIGH_WATER_FRACTION = 0.9
+    MIN_BATCH_SIZE = 500
+    MAX_BATCH_SIZE = int(1e6)
+
+    def __init__(self, max_bytes, sample_size=1000):
+        """Create a new instance."""
+        self.max_bytes = max_bytes
+        self.sample_size = sample_size
+        self.warned = False
+
+    def get_bytes_per_row(self, df):
+        """Return measured bytes per row of dataframe and its records"""
+        if df.shape[0] == 0:
+            return 1
+
+        sample = df.head(self.sample_size).copy()
+        records = alhenaloader.api.get_records(sample)
+
+        record_bytes = sum(get_record_size(record) for record in records)
+        frame_bytes = sample.memory_usage(deep=True).sum()
+
+        return max(1, int((record_bytes + frame_bytes) / sample.shape[0]))
+
+    def get_batch_size(self, bytes_per_row, headroom):
+        """Return number of rows to turn into records at once, given bytes of headroom under the budget"""
+        batch_size = int(max(headroom, 0) * self.BATCH_FRACTION / bytes_per_row)
+
+        if batch_size < self.MIN_BATCH_SIZE:
+            self.warn()
+            return self.MIN_BATCH_SIZE
+
+        return min(batch_size, self.MAX_BATCH_SIZE)
+
+    def get_frame_batch_size(self, df, concurrent_batches=1):
+        """Return batch size for loading dataframe, with concurrent_batches in memory at once"""
+        bytes_per_row = self.get_bytes_per_row(df)
+        headroom = self.max_bytes - get_rss()
+        click.echo(f'Measured {bytes_per_row} bytes per row, {headroom / 1024 ** 2:.0f} MB under memory limit')
+
+        return self.get_batch_size(bytes_per_row * concurrent_batches, headroom)
+
+    def warn(self):
+        if not self.warned:
+            click.secho(f'Memory use is close to the limit of {self.max_bytes / 1024 ** 3:.1f} GB, '
+                        f'loading in batches of at least {self.MIN_BATCH_SIZE} rows', fg="yellow")
+            self.warned = True
+
+    def iter_batches(self, df):
+        """Yield consecutive row batches of dataframe sized to fit the budget"""
+        batch_size = self.get_frame_batch_size(df)
+
+        batch_start_idx = 0
+        while batch_start_idx < df.shape[0]:
+            high_water = self.max_bytes * self.HIGH_WATER_FRACTION
+            if batch_size > self.MIN_BATCH_SIZE and get_rss() > high_water:
+                gc.collect()
+
+                if get_rss() > high_water:
+                    self.warn()
+                    batch_size = max(self.MIN_BATCH_SIZE, batch_size // 2)
+
+            batch_end_idx = min(batch_start_idx + batch_size, df.shape[0])
+            yield df.loc[df.index[batch_start_idx:batch_end_idx]]
+
+            batch_start_idx = batch_end_idx
+
+
+def iter_fixed_batches(df, batch_size):
+    """Yield consecutive row batches of dataframe with batch_size rows"""
+    for batch_start_idx in range(0, df.shape[0], batch_size):
+        batch_end_idx = min(batch_start_idx + batch_size, df.shape[0])
+        yield df.loc[df.index[batch_start_idx:batch_end_idx]]
+
+
+def iter_batches(df, batch_size, memory_budget=None):
+    """Yield row batches of dataframe, sized by memory_budget if given"""
+    if memory_budget is None:
+        return iter_fixed_batches(df, batch_size)
+
+    return memory_budget.iter_batches(df)
@@ -0,0 +1,185 @@
+import glob
+import gzip
+import json
+import os
+
+import click
+from elasticsearch.serializer import JSONSerializer
+
+import alhenaloader.load
+import alhenaloader.memory
+from alhenaloader.api import DEFAULT_MAPPING, get_records
+
+ANALYSIS_FILE = "analysis.json"
+MAPPING_FILE = "mapping.json"
+ALIAS_FILE = "alias.json"
+CELL_HASHES_FILE = "cell_hashes.json"
+SUMMARIES_FILE = "summaries.json"
+SHARD_PATTERN = "part-{:05d}.ndjson.gz"
+
+
+class BulkExporter(object):
+    """Writes bulk actions to compressed NDJSON shards instead of Elasticsearch
+
+    Has the loading interface of ES, so it can be passed to load_data.
+    """
+
+    def __init__(self, directory, shard_size=int(1e6), memory_budget=None):
+        """Create a new instance."""
+        self.directory = directory
+        self.shard_size = shard_size
+        self.memory_budget = memory_budget
+        self.serializer = JSONSerializer()
+
+        self.shards = {}
+
+        os.makedirs(directory, exist_ok=True)
+
+    def create_index(self, index_name, mapping=None):
+        click.echo(f'Exporting index with name {index_name}')
+
+        if mapping is None:
+            mapping = DEFAULT_MAPPING
+
+        index_dir = os.path.join(self.directory, index_name)
+        os.makedirs(index_dir, exist_ok=True)
+
+        for path in glob.glob(os.path.join(index_dir, "*.ndjson.gz")):
+            os.remove(path)
+
+        with open(os.path.join(index_dir, MAPPING_FILE), 'w') as f:
+            json.dump(mapping, f)
+
+        # [shard number, docs written to shard]
+        self.shards[index_name] = [0, 0]
+
+    def create_shared_alias(self, shared_index, alias, analysis_id, mapping=None):
+        """Record shared index and alias, created on replay"""
+        self.create_index(alias, mapping=mapping)
+
+        with open(os.path.join(self.directory, alias, ALIAS_FILE), 'w') as f:
+            json.dump({"shared_index": shared_index, "analysis_id": analysis_id}, f)
+
+    def load_df(self, df, index_name, batch_size=int(1e5), mapping=None):
+        """Batch export dataframe"""
+        total_records = df.shape[0]
+
+        for batch_data in alhenaloader.memory.iter_batches(df, batch_size, self.memory_budget):
+            self.load_records(get_records(batch_data), index_name, mapping=mapping)
+
+        click.echo(f"Exported {total_records} records to {index_name}")
+
+    def load_records(self, records, index, mapping=None):
+        """Append records to shards of index"""
+        if index not in self.shards:
+            self.create_index(index, mapping=mapping)
+
+        action = self.serializer.dumps({"index": {"_index": index}})
+        shard = self.shards[index]
+
+        start = 0
+        while start < len(records):
+            if shard[1] >= self.shard_size:
+                shard[0] += 1
+                shard[1] = 0
+
+            end = min(start + self.shard_size - shard[1], len(records))
+            path = os.path.join(self.directory, index, SHARD_PATTERN.format(shard[0]))
+
+            with gzip.open(path, 'at', encoding='utf-8') as f:
+                for record in records[start:end]:
+                    f.write(action + "\n" + self.serializer.dumps(record) + "\n")
+
+            shard[1] += end - start
+            start = end
+
+    def save_cell_hashes(self, analysis_id, cell_hashes):
+        """Write cell hashes, stored on replay"""
+        with open(os.path.join(self.directory, CELL_HASHES_FILE), 'w') as f:
+            json.dump(cell_hashes, f)
+
+    def save_summaries(self, analysis_id, summaries):
+        """Write summaries, stored on replay"""
+        with open(os.path.join(self.directory, SUMMARIES_FILE), 'w') as f:
+            json.dump(summaries, f)
+
+    def write_analysis(self, analysis_id, metadata_record, projects):
+        """Write analysis record and projects to export"""
+        with open(os.path.join(self.directory, ANALYSIS_FILE), 'w') as f:
+            json.dump({
+                "analysis_id": analysis_id,
+                "record": metadata_record,
+                "projects": projects,
+            }, f)
+
+
+def export_analysis(analysis_id, data, metadata_record, projects, exporter, framework, cache=None, cache_key=None,
+                    **index_options):
+    """Export analysis to NDJSON files without connecting to Elasticsearch"""
+    stats = alhenaloader.load.load_data(data, analysis_id, exporter, framework, cache=cache, cache_key=cache_key,
+                                        **index_options)
+
+    alhenaloader.load.add_load_stats(metadata_record, stats)
+
+    exporter.write_analysis(analysis_id, metadata_record, projects)
+
+
+def read_bulk_bodies(path, chunk_size):
+    """Yield bulk bodies of chunk_size actions from NDJSON shard"""
+    with gzip.open(path, 'rb') as f:
+        lines = []
+        for line in f:
+            lines.append(line)
+
+            if len(lines) >= 2 * chunk_size:
+                yield b"".join(lines)
+                lines = []
+
+        if lines:
+            yield b"".join(lines)
+
+
+def replay(directory, es, chunk_size=5000):
+    """Load exported analysis in directory into Elasticsearch"""
+    with open(os.path.join(directory, ANALYSIS_FILE)) as f:
+        analysis = json.load(f)
+
+    for index_dir in sorted(glob.glob(os.path.join(directory, "*", ""))):
+        index = os.path.basename(os.path.dirname(index_dir))
+
+        with open(os.path.join(index_dir, MAPPING_FILE)) as f:
+            mapping = json.load(f)
+
+        alias_path = os.path.join(index_dir, ALIAS_FILE)
+        if os.path.exists(alias_path):
+            with open(alias_path) as f:
+                alias = json.load(f)
+            es.create_shared_alias(alias["shared_index"], index, alias["analysis_id"], mapping=mapping)
+
+        elif not es.es.indices.exists(index):
+            es.create_index(index, mapping=mapping)
+
+        shards = sorted(glob.glob(os.path.join(index_dir, "*.ndjson.gz")))
+        bodies = (body for shard in shards for body in read_bulk_bodies(shard, chunk_size))
+
+        num_records = es.load_bulk_bodies(bodies)
+        click.echo(f"Replayed {num_records} records to {index}")
+
+        # Exports from before load statistics were recorded cannot be checked
+        data_type = index[len(f"{analysis['analysis_id'].lower()}_"):]
+        expected = analysis["record"].get("load_stats", {}).get(data_type, {}).get("count")
+        if expected is not None and num_records != expected:
+            raise ValueError(
+                f'mismatch in {num_records} records replayed to {expected} records exported for {index}')
+
+    cell_hashes_path = os.path.join(directory, CELL_HASHES_FILE)
+    if os.path.exists(cell_hashes_path):
+        with open(cell_hashes_path) as f:
+            es.save_cell_hashes(analysis["analysis_id"], json.load(f))
+
+    summaries_path = os.path.join(directory, SUMMARIES_FILE)
+    if os.path.exists(summaries_path):
+        with open(summaries_path) as f:
+            es.save_summaries(analysis["analysis_id"], json.load(f))
+
+    alhenaloader.load.register_analysis(analysis["analysis_id"], analysis["record"], analysis["projects"], es)
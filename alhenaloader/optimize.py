@@ -0,0 +1,123 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+
+import alhenaloader.load
+
+SHRUNK_SUFFIX = "_shrunk"
+
+
+def optimize_analyses(es, analysis_ids=None, max_num_segments=1, shrink=False, concurrency=4):
+    """Force merge and make read-only the indices of analyses, all analyses if none are given"""
+    if analysis_ids is None:
+        analysis_ids = [analysis['dashboard_id'] for analysis in es.get_analyses()]
+
+    indices = [f"{analysis_id.lower()}_{data_type}"
+               for analysis_id in analysis_ids for data_type in alhenaloader.load.GET_DATA]
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(
+            lambda index: optimize_index(index, es, max_num_segments=max_num_segments, shrink=shrink),
+            indices))
+
+    click.echo(f"Optimized {results.count('optimized')} indices, skipped {results.count('skipped')}")
+
+
+def optimize_index(index, es, max_num_segments=1, shrink=False):
+    """Force merge index, optionally shrink it to one shard, and block writes
+
+    Returns 'optimized', or 'skipped' for missing, shared or already read-only indices.
+    """
+    alias = es.get_alias(index)
+    if alias is not None and alias['filtered']:
+        # Shared indices are still written to by other analyses
+        return 'skipped'
+
+    if alias is None and not es.es.indices.exists(index):
+        return 'skipped'
+
+    concrete_index = index if alias is None else alias['index']
+    settings = get_index_settings(concrete_index, es)
+    if settings.get('blocks', {}).get('write') == 'true':
+        return 'skipped'
+
+    click.echo(f"Force merging {concrete_index}")
+    es.es.indices.forcemerge(index=concrete_index, max_num_segments=max_num_segments, request_timeout=3600)
+
+    if shrink and int(settings['number_of_shards']) > 1:
+        concrete_index = shrink_index(concrete_index, es)
+    else:
+        es.es.indices.put_settings(index=concrete_index, body={'index.blocks.write': True})
+
+    return 'optimized'
+
+
+def get_index_settings(index, es):
+    return next(iter(es.es.indices.get_settings(index=index).values()))['settings']['index']
+
+
+def shrink_index(index, es, timeout=1800):
+    """Shrink index to one shard, replacing it with an alias of the same name
+
+    Replicas are dropped while primaries are moved to one node, and restored
+    on the shrunk index. If shrinking fails, the index is moved back and
+    made writable again.
+    """
+    replicas = get_index_settings(index, es).get('number_of_replicas', '1')
+    node = next(shard['node'] for shard in es.es.cat.shards(index=index, format='json') if shard['prirep'] == 'p')
+
+    click.echo(f"Moving shards of {index} to {node} to shrink")
+    es.es.indices.put_settings(index=index, body={
+        # A primary cannot move to a node holding its own replica
+        'index.number_of_replicas': 0,
+        'index.routing.allocation.require._name': node,
+        'index.blocks.write': True,
+    })
+
+    target = f"{index}{SHRUNK_SUFFIX}"
+    try:
+        wait_for_primaries_on_node(index, node, es, timeout=timeout)
+
+        click.echo(f"Shrinking {index} to {target}")
+        es.es.indices.shrink(index=index, target=target, body={
+            'settings': {
+                'index.number_of_shards': 1,
+                'index.number_of_replicas': replicas,
+                'index.routing.allocation.require._name': None,
+                'index.blocks.write': True,
+            }
+        })
+        es.es.cluster.health(index=target, wait_for_status='yellow', timeout=f'{timeout}s',
+                             request_timeout=timeout)
+
+    except Exception:
+        click.secho(f"Shrinking {index} failed, restoring it", fg="red")
+        es.es.indices.delete(index=target, ignore=[400, 404])
+        es.es.indices.put_settings(index=index, body={
+            'index.number_of_replicas': replicas,
+            'index.routing.allocation.require._name': None,
+            'index.blocks.write': None,
+        })
+        raise
+
+    es.es.indices.delete(index=index)
+    es.es.indices.put_alias(index=target, name=index)
+
+    return target
+
+
+def wait_for_primaries_on_node(index, node, es, timeout=1800, interval=5):
+    """Wait until every shard of index is a started primary on node"""
+    deadline = time.monotonic() + timeout
+
+    while True:
+        shards = es.es.cat.shards(index=index, format='json')
+        if all(shard['prirep'] == 'p' and shard['state'] == 'STARTED' and shard['node'] == node
+               for shard in shards):
+            return
+
+        if time.monotonic() > deadline:
+            raise Exception(f"Shards of {index} were not moved to {node} within {timeout} seconds")
+
+        time.sleep(interval)
@@ -0,0 +1,84 @@
+import contextlib
+import cProfile
+import io
+import os
+import pstats
+import threading
+
+import click
+
+
+class Profiler(object):
+    """Collects a cProfile profile for each named phase of a run"""
+
+    def __init__(self, directory, top=20):
+        """Create a new instance."""
+        self.directory = directory
+        self.top = top
+        self.profiles = {}
+        self.active = None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Profile code in block as part of phase name
+
+        Phases nested in another phase, or started off the main thread, are
+        counted in the enclosing phase instead.
+        """
+        if self.active is not None or threading.current_thread() is not threading.main_thread():
+            yield
+            return
+
+        profile = self.profiles.setdefault(name, cProfile.Profile())
+        self.active = name
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            self.active = None
+
+    def write(self):
+        """Write profile file per phase and summary of hottest functions"""
+        os.makedirs(self.directory, exist_ok=True)
+
+        summary = io.StringIO()
+        for name, profile in self.profiles.items():
+            profile.dump_stats(os.path.join(self.directory, f"{name}.prof"))
+
+            stats = pstats.Stats(profile, stream=summary)
+            summary.write(f"==== {name}: {stats.total_tt:.2f}s ====\n")
+            stats.sort_stats('tottime').print_stats(self.top)
+
+        with open(os.path.join(self.directory, "summary.txt"), 'w') as f:
+            f.write(summary.getvalue())
+
+        for name, profile in self.profiles.items():
+            click.echo(f"Profile {name}: {pstats.Stats(profile).total_tt:.2f}s")
+        click.echo(f"Wrote profiles to {self.directory}")
+
+
+_profiler = None
+
+
+def enable(directory, top=20):
+    """Start profiling phases of this process"""
+    global _profiler
+    _profiler = Profiler(directory, top=top)
+    return _profiler
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Profile block as phase name if profiling is enabled"""
+    if _profiler is None:
+        yield
+    else:
+        with _profiler.phase(name):
+            yield
+
+
+def write():
+    """Write collected profiles if profiling is enabled"""
+    if _profiler is not None:
+        _profiler.write()
@@ -0,0 +1,106 @@
+import datetime
+import time
+
+import click
+
+import alhenaloader.load
+from alhenaloader.snapshot import get_index_definition
+
+# Keeps document IDs unique when copies share an index with the source
+SHARED_COPY_SCRIPT = "ctx._source.dashboard_id = params.id; ctx._routing = params.id; ctx._id = params.id + '_' + ctx._id"
+
+
+def copy_analysis(source_id, target_id, es, method='clone', slices='auto', poll_interval=5):
+    """Copy indices, record and project membership of analysis to new analysis ID on the server"""
+    assert es.is_loaded(source_id), f"Analysis with id {source_id} is not loaded"
+    assert not es.is_loaded(target_id), f"Analysis with id {target_id} is already loaded"
+
+    for data_type in alhenaloader.load.GET_DATA:
+        source_index = f"{source_id.lower()}_{data_type}"
+        target_index = f"{target_id.lower()}_{data_type}"
+
+        if not es.es.indices.exists(source_index):
+            click.secho(f"Index {source_index} does not exist, skipping", fg="yellow")
+            continue
+
+        assert not es.es.indices.exists(target_index), f"Index {target_index} already exists"
+
+        alias = es.get_alias(source_index)
+        if alias is not None and alias['filtered']:
+            copy_shared_alias(source_index, target_index, target_id, es, slices, poll_interval)
+        elif method == 'clone':
+            clone_index(source_index if alias is None else alias['index'], target_index, es)
+        else:
+            es.create_index(target_index, mapping=get_index_definition(source_index, es))
+            reindex({'source': {'index': source_index}, 'dest': {'index': target_index}},
+                    es, slices, poll_interval)
+
+    copy_side_records(source_id, target_id, es)
+
+    record = es.es.get(index=es.ANALYSIS_ENTRY_INDEX, id=source_id)['_source']
+    record['timestamp'] = datetime.datetime.now().isoformat()
+    record['dashboard_id'] = target_id
+    record['jira_id'] = target_id
+
+    alhenaloader.load.register_analysis(target_id, record, es.get_analysis_projects(source_id), es)
+
+
+def copy_side_records(source_id, target_id, es):
+    """Copy cell hashes and summaries of analysis, stored under the new analysis ID"""
+    cell_hashes = es.get_cell_hashes(source_id)
+    if cell_hashes is not None:
+        es.save_cell_hashes(target_id, cell_hashes)
+
+    summaries = es.get_summaries(source_id)
+    if summaries is not None:
+        es.save_summaries(target_id, summaries)
+
+
+def clone_index(source_index, target_index, es):
+    """Clone index, which needs the source to be briefly read-only"""
+    settings = next(iter(es.es.indices.get_settings(index=source_index).values()))['settings']['index']
+    was_read_only = settings.get('blocks', {}).get('write') == 'true'
+
+    click.echo(f"Cloning {source_index} to {target_index}")
+    if not was_read_only:
+        es.es.indices.put_settings(index=source_index, body={'index.blocks.write': True})
+
+    try:
+        es.es.indices.clone(index=source_index, target=target_index, wait_for_active_shards=1)
+    finally:
+        if not was_read_only:
+            es.es.indices.put_settings(index=source_index, body={'index.blocks.write': None})
+            es.es.indices.put_settings(index=target_index, body={'index.blocks.write': None}, ignore=404)
+
+
+def copy_shared_alias(source_alias, target_alias, target_id, es, slices, poll_interval):
+    """Copy documents behind alias within its shared index, under a new alias"""
+    shared_index = next(iter(es.es.indices.get_alias(name=source_alias)))
+
+    es.create_shared_alias(shared_index, target_alias, target_id)
+    reindex({
+        'source': {'index': source_alias},
+        'dest': {'index': shared_index},
+        'script': {'source': SHARED_COPY_SCRIPT, 'params': {'id': target_id}},
+    }, es, slices, poll_interval)
+
+
+def reindex(body, es, slices, poll_interval):
+    """Run sliced reindex as a task, reporting progress until it completes"""
+    click.echo(f"Reindexing {body['source']['index']} to {body['dest']['index']}")
+    task_id = es.es.reindex(body=body, slices=slices, refresh=True, wait_for_completion=False)['task']
+
+    while True:
+        task = es.es.tasks.get(task_id=task_id)
+        status = task['task']['status']
+        done = status['created'] + status['updated']
+        click.echo(f"Copied {done} / {status['total']} records")
+
+        if task['completed']:
+            break
+
+        time.sleep(poll_interval)
+
+    failures = task.get('response', {}).get('failures', [])
+    if len(failures) > 0 or 'error' in task:
+        raise Exception(f"Reindex of {body['source']['index']} failed: {task.get('error') or failures[:5]}")
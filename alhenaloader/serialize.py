@@ -0,0 +1,72 @@
+import functools
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import pyarrow as pa
+import pyarrow.feather as feather
+from elasticsearch.serializer import JSONSerializer
+
+import alhenaloader.api
+
+# Encodes values JSON does not, such as dates and numpy and pandas scalars,
+# as the serializer of the threaded path does
+default = JSONSerializer().default
+
+try:
+    import orjson
+
+    def dumps(obj):
+        return orjson.dumps(obj, default=default, option=orjson.OPT_SERIALIZE_NUMPY)
+
+except ImportError:
+    import json
+
+    def dumps(obj):
+        return json.dumps(obj, default=default, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+DEFAULT_ROWS_PER_BODY = 5000
+
+
+@functools.lru_cache(maxsize=4)
+def open_table(path):
+    """Return memory-mapped Arrow table, opened once per worker process"""
+    return pa.ipc.open_file(pa.memory_map(path)).read_all()
+
+
+def serialize_rows(path, index, start, stop):
+    """Return bulk body for rows start to stop of Arrow file"""
+    df = open_table(path).slice(start, stop - start).to_pandas()
+
+    action = dumps({"index": {"_index": index}}) + b"\n"
+    records = alhenaloader.api.get_records(df)
+
+    return b"".join(action + dumps(record) + b"\n" for record in records)
+
+
+def serialize_df(df, index, processes, rows_per_body=DEFAULT_ROWS_PER_BODY):
+    """Yield bulk bodies for dataframe, serialized in a pool of worker processes
+
+    The dataframe is written once to an uncompressed Arrow file that workers
+    memory-map, so rows are never pickled between processes.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, f"{index}.arrow")
+        feather.write_feather(df.reset_index(drop=True), path, compression='uncompressed')
+
+        ranges = ((start, min(start + rows_per_body, df.shape[0])) for start in range(0, df.shape[0], rows_per_body))
+
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            pending = set()
+            for start, stop in ranges:
+                pending.add(executor.submit(serialize_rows, path, index, start, stop))
+
+                # Bound the number of serialized bodies held in memory
+                if len(pending) >= 2 * processes:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+
+            for future in pending:
+                yield future.result()
@@ -0,0 +1,147 @@
+import glob
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+import pandas as pd
+import pyarrow.parquet as pq
+
+import alhenaloader.load
+import alhenaloader.serialize
+from alhenaloader.api import get_records
+
+SNAPSHOT_FILE = "analysis.json"
+KEPT_SETTINGS = ['number_of_shards', 'max_result_window', 'sort']
+
+
+def export_snapshot(analysis_id, directory, es, slices=4, scroll_size=10000):
+    """Write all indices, the analysis record, its cell hashes and summaries and project membership to directory"""
+    record = es.es.get(index=es.ANALYSIS_ENTRY_INDEX, id=analysis_id)['_source']
+
+    os.makedirs(directory, exist_ok=True)
+    mappings = {}
+
+    for data_type in alhenaloader.load.GET_DATA:
+        index = f"{analysis_id.lower()}_{data_type}"
+        if not es.es.indices.exists(index):
+            click.secho(f"Index {index} does not exist, skipping", fg="yellow")
+            continue
+
+        mappings[data_type] = get_index_definition(index, es)
+
+        type_dir = os.path.join(directory, data_type)
+        os.makedirs(type_dir, exist_ok=True)
+        for path in glob.glob(os.path.join(type_dir, "*.parquet")):
+            os.remove(path)
+
+        with ThreadPoolExecutor(max_workers=slices) as executor:
+            counts = list(executor.map(
+                lambda slice_id: export_slice(index, type_dir, slice_id, slices, es, scroll_size),
+                range(slices)))
+
+        click.echo(f"Exported {sum(counts)} records from {index}")
+
+    with open(os.path.join(directory, SNAPSHOT_FILE), 'w') as f:
+        json.dump({
+            "analysis_id": analysis_id,
+            "record": record,
+            "projects": es.get_analysis_projects(analysis_id),
+            "mappings": mappings,
+            "cell_hashes": es.get_cell_hashes(analysis_id),
+            "summaries": es.get_summaries(analysis_id),
+        }, f)
+
+
+def get_index_definition(index, es):
+    """Return mappings and portable settings of index to recreate it with"""
+    definition = next(iter(es.es.indices.get(index=index).values()))
+
+    mappings = definition['mappings']
+    # Routing is only required in the shared layout, snapshots restore to per-analysis indices
+    mappings.pop('_routing', None)
+
+    index_settings = definition['settings']['index']
+    return {
+        'settings': {'index': {key: index_settings[key] for key in KEPT_SETTINGS if key in index_settings}},
+        'mappings': mappings,
+    }
+
+
+def export_slice(index, directory, slice_id, slices, es, scroll_size):
+    """Write one slice of index to parquet files, one per scroll page"""
+    body = {"query": {"match_all": {}}}
+    if slices > 1:
+        body["slice"] = {"id": slice_id, "max": slices}
+
+    response = es.es.search(index=index, body=body, scroll='5m', size=scroll_size)
+    scroll_id = response['_scroll_id']
+
+    num_records = 0
+    page = 0
+    try:
+        while len(response['hits']['hits']) > 0:
+            df = pd.DataFrame([hit['_source'] for hit in response['hits']['hits']])
+            df.to_parquet(os.path.join(directory, f"slice-{slice_id:03d}-{page:06d}.parquet"), compression='zstd')
+
+            num_records += df.shape[0]
+            page += 1
+
+            response = es.es.scroll(scroll_id=scroll_id, scroll='5m')
+            scroll_id = response['_scroll_id']
+    finally:
+        es.es.clear_scroll(scroll_id=scroll_id, ignore=404)
+
+    return num_records
+
+
+def import_snapshot(directory, es):
+    """Restore analysis exported with export_snapshot"""
+    with open(os.path.join(directory, SNAPSHOT_FILE)) as f:
+        snapshot = json.load(f)
+
+    analysis_id = snapshot["analysis_id"]
+    assert not es.is_loaded(analysis_id), f"Analysis with id {analysis_id} is already loaded"
+
+    for data_type, mapping in snapshot["mappings"].items():
+        index = f"{analysis_id.lower()}_{data_type}"
+        assert not es.es.indices.exists(index), f"Index {index} already exists"
+
+        es.create_index(index, mapping=mapping)
+
+        paths = sorted(glob.glob(os.path.join(directory, data_type, "*.parquet")))
+        total_records = sum(pq.ParquetFile(path).metadata.num_rows for path in paths)
+
+        # All pages of index go through one stream of bulk requests
+        num_records = es.load_bulk_bodies(read_bulk_bodies(paths, index))
+        click.echo(f"Imported {num_records} records to {index}")
+
+        if total_records != num_records:
+            raise ValueError(
+                f'mismatch in {num_records} records loaded to {total_records} total records')
+
+    # Snapshots from before cell hashes and summaries were stored have neither
+    if snapshot.get("cell_hashes") is not None:
+        es.save_cell_hashes(analysis_id, snapshot["cell_hashes"])
+
+    if snapshot.get("summaries") is not None:
+        es.save_summaries(analysis_id, snapshot["summaries"])
+
+    projects = [project for project in snapshot["projects"] if es.is_project_exist(project)]
+    missing_projects = set(snapshot["projects"]) - set(projects)
+    if len(missing_projects) > 0:
+        click.secho(f"Projects do not exist, not adding to: {sorted(missing_projects)}", fg="yellow")
+
+    alhenaloader.load.register_analysis(analysis_id, snapshot["record"], projects, es)
+
+
+def read_bulk_bodies(paths, index, chunk_size=5000):
+    """Yield bulk bodies of chunk_size actions indexing the rows of parquet files into index"""
+    action = alhenaloader.serialize.dumps({"index": {"_index": index}}) + b"\n"
+
+    for path in paths:
+        records = get_records(pd.read_parquet(path))
+
+        for start in range(0, len(records), chunk_size):
+            yield b"".join(action + alhenaloader.serialize.dumps(record) + b"\n"
+                           for record in records[start:start + chunk_size])
@@ -0,0 +1,96 @@
+import threading
+import time
+
+
+class TokenBucket(object):
+    """Thread-safe token bucket refilled at rate tokens per second"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = rate if capacity is None else capacity
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount, factor=1.0):
+        """Take amount tokens, returns seconds to wait before using them
+
+        factor scales the refill rate down, for adaptive throttling.
+        """
+        with self.lock:
+            now = time.monotonic()
+            rate = self.rate * factor
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * rate)
+            self.updated = now
+
+            self.tokens -= amount
+            return 0.0 if self.tokens >= 0 else -self.tokens / rate
+
+
+class Throttle(object):
+    """Ceiling on documents and bytes per second sent by all loads in a process
+
+    In adaptive mode the ceilings are lowered while bulk requests are slow or
+    the cluster's write queue is deep, and recover once they are not.
+    """
+
+    MIN_FACTOR = 0.05
+    BACKOFF = 0.7
+    RECOVERY = 1.05
+
+    def __init__(self, docs_per_sec=None, bytes_per_sec=None, adaptive=False, target_latency=2.0, max_queue=50):
+        """Create a new instance."""
+        assert docs_per_sec is not None or bytes_per_sec is not None, 'Throttle needs a docs or bytes per second ceiling'
+
+        self.docs = None if docs_per_sec is None else TokenBucket(docs_per_sec)
+        self.bytes = None if bytes_per_sec is None else TokenBucket(bytes_per_sec)
+
+        self.adaptive = adaptive
+        self.target_latency = target_latency
+        self.max_queue = max_queue
+        self.factor = 1.0
+
+        # Last verdicts of bulk latency and write queue depth
+        self.slow = False
+        self.queued = False
+        self.lock = threading.Lock()
+
+    def reserve(self, docs, nbytes):
+        """Take allowance for request, returns seconds to wait before sending it"""
+        delays = [0.0]
+        if self.docs is not None:
+            delays.append(self.docs.reserve(docs, self.factor))
+        if self.bytes is not None:
+            delays.append(self.bytes.reserve(nbytes, self.factor))
+
+        return max(delays)
+
+    def wait(self, docs, nbytes):
+        time.sleep(self.reserve(docs, nbytes))
+
+    def observe_latency(self, seconds):
+        if self.adaptive:
+            with self.lock:
+                self.slow = seconds > self.target_latency
+                self._adjust(self.slow, self.queued)
+
+    def observe_queue(self, depth):
+        if self.adaptive:
+            with self.lock:
+                self.queued = depth > self.max_queue
+                self._adjust(self.queued, self.slow)
+
+    def _adjust(self, overloaded, other_overloaded):
+        # Each signal backs off when it reports overload, and the ceilings
+        # only recover while the last verdicts of both signals are healthy
+        if overloaded:
+            self.factor = max(self.MIN_FACTOR, self.factor * self.BACKOFF)
+        elif not other_overloaded:
+            self.factor = min(1.0, self.factor * self.RECOVERY)
+
+
+def get_bulk_size(serializer, records, index):
+    """Return bytes of bulk body indexing records, as the bulk helpers serialize it"""
+    action_bytes = len(serializer.dumps({"index": {"_index": index}}).encode('utf-8')) + 1
+
+    return sum(action_bytes + len(serializer.dumps(record).encode('utf-8')) + 1 for record in records)
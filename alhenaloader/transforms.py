@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+
+
+# Increase whenever transforms change the frames they produce, so cached frames are not reused
+TRANSFORM_VERSION = 2
+
+BOOL_KEYWORDS = {True: 'true', False: 'false'}
+
+
+class Rename(object):
+    """Rename columns"""
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def __call__(self, df):
+        df.rename(columns=self.columns, inplace=True)
+        return df
+
+
+class Ratio(object):
+    """Add column with ratio of two columns"""
+
+    def __init__(self, name, numerator, denominator):
+        self.name = name
+        self.numerator = numerator
+        self.denominator = denominator
+
+    def __call__(self, df):
+        df[self.name] = df[self.numerator] / df[self.denominator]
+        return df
+
+
+class Remap(object):
+    """Map values of column, once per unique value, into a categorical column"""
+
+    def __init__(self, column, mapping, name=None):
+        self.column = column
+        self.mapping = mapping
+        self.name = column if name is None else name
+
+    def __call__(self, df):
+        df[self.name] = remap_categories(df[self.column], self.mapping)
+        return df
+
+
+class BoolToKeyword(object):
+    """Replace boolean column with 'true'/'false' keywords, raising on any other value"""
+
+    def __init__(self, column):
+        self.column = column
+
+    def __call__(self, df):
+        series = df[self.column]
+
+        invalid = series[~series.isin(list(BOOL_KEYWORDS))]
+        if invalid.shape[0] > 0:
+            raise ValueError(f"Expected only booleans in {self.column}, but got {list(invalid.unique()[:5])}")
+
+        df[self.column] = remap_categories(series, BOOL_KEYWORDS)
+        return df
+
+
+def apply_transforms(df, transforms):
+    """Apply list of transforms to dataframe in order"""
+    for transform in transforms:
+        df = transform(df)
+    return df
+
+
+def remap_categories(series, mapping):
+    """Return categorical series with values mapped, looking up each unique value once"""
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        series = series.astype('category')
+
+    old_categories = list(series.cat.categories)
+    new_values = [mapping.get(category, category) for category in old_categories]
+    new_categories = sorted(set(new_values), key=str)
+
+    positions = {value: position for position, value in enumerate(new_categories)}
+
+    lookup = np.array([positions[value] for value in new_values] + [-1], dtype=np.int64)
+    # Missing values have code -1, which indexes the trailing -1 in lookup
+    codes = lookup[series.cat.codes.to_numpy()]
+
+    return pd.Series(pd.Categorical.from_codes(codes, categories=new_categories),
+                     index=series.index, name=series.name)
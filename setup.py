@@ -53,6 +53,7 @@ setup(
         'elasticsearch>=7.0.0,<8.0.0',
         'numpy',
         'pandas==1.4',
+        'pyarrow',
         'scgenome @ git+https://github.com/mondrian-scwgs/scgenome.git@alhenaloader#egg=scgenome',
         'pyyaml',
         'scikit-learn',
@@ -64,6 +65,10 @@ setup(
         'numba',
         'pyBigWig',
     ],
+    extras_require={
+        'async': ['elasticsearch[async]>=7.8.0,<8.0.0'],
+        'memory': ['psutil'],
+    },
     entry_points="""
     [console_scripts]
     alhenaloader=alhenaloader.cli:cli
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule:: test_api
+
+Tests of the Elasticsearch connection helpers.
+"""
+from types import SimpleNamespace
+
+from alhenaloader.api import ES
+
+
+def get_es(existing):
+    calls = []
+    es = ES.__new__(ES)
+    es.es = SimpleNamespace(
+        indices=SimpleNamespace(
+            exists=lambda index: index in existing,
+            put_settings=lambda index, body: calls.append(('put_settings', index, body)),
+        ),
+        delete_by_query=lambda index, body, refresh: calls.append(
+            ('delete_by_query', index, body['query']['bool']['filter']['terms']['cell_id'])),
+    )
+    return es, calls
+
+
+def test_delete_cells_without_cells_keeps_write_block():
+    """
+    Arrange/Act: Delete no cells, as delta loads do for unchanged data types, and cells of a missing index.
+    Assert: Nothing is written, so optimized indices stay read-only.
+    """
+    es, calls = get_es(existing={'a1_qc'})
+
+    es.delete_cells('a1_qc', [])
+    es.delete_cells('a1_segs', ['cell_0'])
+
+    assert calls == []
+
+
+def test_delete_cells_clears_write_block_then_deletes_in_batches():
+    """
+    Arrange/Act: Delete three cells in batches of two.
+    Assert: The write block is cleared once, before cells are deleted in two batches.
+    """
+    es, calls = get_es(existing={'a1_qc'})
+
+    es.delete_cells('a1_qc', ['a', 'b', 'c'], batch_size=2)
+
+    assert calls == [
+        ('put_settings', 'a1_qc', {'index.blocks.write': None}),
+        ('delete_by_query', 'a1_qc', ['a', 'b']),
+        ('delete_by_query', 'a1_qc', ['c']),
+    ]
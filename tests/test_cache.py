@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule:: test_cache
+
+Tests of the cache of transformed dataframes.
+"""
+import os
+
+import pandas as pd
+
+from alhenaloader.cache import FrameCache, hash_inputs
+
+
+def write_file(path, content):
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+def get_df(n):
+    return pd.DataFrame({'cell_id': [f'cell_{i}' for i in range(n)], 'value': range(n)})
+
+
+def test_hash_inputs_changes_with_content_and_framework(tmp_path):
+    """
+    Arrange: Write a results directory.
+    Act: Hash it, then change the framework and then a file.
+    Assert: Each change gives a new key, and rehashing unchanged inputs does not.
+    """
+    write_file(tmp_path / 'metrics.csv', 'a,b\n1,2\n')
+
+    key = hash_inputs([str(tmp_path)], 'scp')
+    assert key == hash_inputs([str(tmp_path)], 'scp')
+    assert key != hash_inputs([str(tmp_path)], 'mondrian')
+
+    write_file(tmp_path / 'metrics.csv', 'a,b\n1,3\n')
+    assert key != hash_inputs([str(tmp_path)], 'scp')
+
+
+def test_hash_inputs_includes_transform_version(tmp_path, monkeypatch):
+    """
+    Arrange: Write a results directory.
+    Act: Hash it before and after increasing the transform version.
+    Assert: The keys differ, so frames cached by older transforms are not reused.
+    """
+    write_file(tmp_path / 'metrics.csv', 'a,b\n1,2\n')
+    key = hash_inputs([str(tmp_path)], 'scp')
+
+    monkeypatch.setattr('alhenaloader.cache.TRANSFORM_VERSION', -1)
+    assert key != hash_inputs([str(tmp_path)], 'scp')
+
+
+def test_get_returns_stored_frame(tmp_path):
+    """
+    Arrange/Act: Store a frame.
+    Assert: It is returned for its key and data type, and missing entries return None.
+    """
+    cache = FrameCache(str(tmp_path))
+    df = get_df(10)
+
+    cache.put('key', 'qc', df)
+
+    pd.testing.assert_frame_equal(cache.get('key', 'qc'), df)
+    assert cache.get('key', 'segs') is None
+    assert cache.has('key', ['qc'])
+    assert not cache.has('key', ['qc', 'segs'])
+
+
+def test_put_evicts_least_recently_used(tmp_path):
+    """
+    Arrange: Fill a cache that holds two entries, then read the older one.
+    Act: Store a third entry.
+    Assert: The entry least recently used is evicted.
+    """
+    cache = FrameCache(str(tmp_path))
+    cache.put('a', 'qc', get_df(100))
+    cache.put('b', 'qc', get_df(100))
+
+    os.utime(cache.path('a', 'qc'), (1, 1))
+    os.utime(cache.path('b', 'qc'), (2, 2))
+    cache.max_size = cache.stats()['size']
+
+    cache.get('a', 'qc')
+    cache.put('c', 'qc', get_df(100))
+
+    assert cache.has('a', ['qc'])
+    assert not cache.has('b', ['qc'])
+    assert cache.has('c', ['qc'])
+
+
+def test_purge_removes_only_key(tmp_path):
+    """
+    Arrange: Store entries under two keys.
+    Act: Purge one key.
+    Assert: Only the entries of that key are removed.
+    """
+    cache = FrameCache(str(tmp_path))
+    cache.put('a', 'qc', get_df(10))
+    cache.put('a', 'segs', get_df(10))
+    cache.put('b', 'qc', get_df(10))
+
+    assert cache.purge('a') == 2
+    assert cache.stats()['entries'] == 1
+    assert cache.has('b', ['qc'])
@@ -54,3 +54,59 @@ def test_hello_displays_expected_message():
     assert 'alhenaloader' in result.output.strip(), \
         "'Hello' messages should contain the CLI name."
     # fmt: on
+
+
+def test_cache_stats_and_purge(tmp_path):
+    """
+    Arrange: Store a frame in a cache directory.
+    Act: Run `cache-stats` and then `cache-purge` on it.
+    Assert: The entry is reported and then removed.
+    """
+    import pandas as pd
+    from alhenaloader.cache import FrameCache
+
+    FrameCache(str(tmp_path)).put('key', 'qc', pd.DataFrame({'cell_id': ['a']}))
+
+    runner: CliRunner = CliRunner()
+    result: Result = runner.invoke(cli.cli, ["--cache-dir", str(tmp_path), "cache-stats"])
+    assert result.exit_code == 0
+    assert "Entries: 1" in result.output
+
+    result = runner.invoke(cli.cli, ["--cache-dir", str(tmp_path), "cache-purge", "--key", "key"])
+    assert result.exit_code == 0
+    assert "Removed 1 entries" in result.output
+
+
+def test_adaptive_needs_ceiling():
+    """
+    Arrange/Act: Run the `version` subcommand with --adaptive but no ceiling.
+    Assert: A warning that --adaptive needs a ceiling is shown.
+    """
+    runner: CliRunner = CliRunner()
+    result: Result = runner.invoke(cli.cli, ["--adaptive", "version"])
+    assert result.exit_code == 0
+    assert "--adaptive needs" in result.output
+
+
+def test_load_lists_options():
+    """
+    Arrange/Act: Show help of the `load` subcommand.
+    Assert: Options for caching, delta, progressive and memory bounded loads are listed.
+    """
+    runner: CliRunner = CliRunner()
+    result: Result = runner.invoke(cli.cli, ["load", "--help"])
+    assert result.exit_code == 0
+    for option in ["--cache", "--delta", "--progressive", "--max-memory"]:
+        assert option in result.output
+
+
+def test_load_needs_analysis_id():
+    """
+    Arrange/Act: Run the `load` subcommand with a memory budget but no analysis ID.
+    Assert: It asks for an analysis ID before reading any data.
+    """
+    runner: CliRunner = CliRunner()
+    result: Result = runner.invoke(cli.cli, ["load", "--qc", "missing", "--library", "L", "--sample", "S",
+                                             "--description", "D", "--max-memory", "4"])
+    assert result.exit_code == 0
+    assert "Please specify a analysis ID" in result.output
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule:: test_connection
+
+Tests of parsing Elasticsearch hosts.
+"""
+import pytest
+
+from alhenaloader.connection import parse_hosts
+
+
+@pytest.mark.parametrize("host,expected", [
+    ('node', {'host': 'node', 'port': 9200}),
+    ('node:9300', {'host': 'node', 'port': 9300}),
+    ('https://node:9201', {'host': 'node', 'port': 9201}),
+    ('https://node/', {'host': 'node', 'port': 9200}),
+    ('[::1]:9400', {'host': '::1', 'port': 9400}),
+    ('[fe80::1]', {'host': 'fe80::1', 'port': 9200}),
+    ('fe80::1', {'host': 'fe80::1', 'port': 9200}),
+])
+def test_parse_host(host, expected):
+    """
+    Arrange/Act: Parse a host.
+    Assert: Its name and port, or the default port, are returned.
+    """
+    assert parse_hosts(host, 9200) == [expected]
+
+
+def test_parse_host_lists():
+    """
+    Arrange/Act: Parse repeated and comma separated hosts.
+    Assert: One host dict is returned per host, skipping empty entries.
+    """
+    assert parse_hosts(['a,b:9300', ' c ,'], 9200) == [
+        {'host': 'a', 'port': 9200},
+        {'host': 'b', 'port': 9300},
+        {'host': 'c', 'port': 9200},
+    ]
+
+
+@pytest.mark.parametrize("host", ['http://node:9200', 'https://node/prefix', 'node:port', 'https://user:pw@node'])
+def test_parse_host_rejects_unsupported(host):
+    """
+    Arrange/Act: Parse a host with another scheme, a path, credentials or an invalid port.
+    Assert: Parsing raises instead of mangling the host name.
+    """
+    with pytest.raises(Exception):
+        parse_hosts(host, 9200)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule:: test_load
+
+Tests of the dataframe preparation in the load module.
+"""
+import numpy as np
+import pandas as pd
+
+from alhenaloader.load import compact_dtypes, get_cell_hashes
+
+
+def test_compact_dtypes_is_lossless():
+    """
+    Arrange: Build a frame with ids, small integers and floats.
+    Act: Compact its dtypes.
+    Assert: Columns are downcast or made categorical, and all values are unchanged.
+    """
+    df = pd.DataFrame({
+        'cell_id': ['a', 'a', 'b'],
+        'state': [1, 2, 3],
+        'reads': [0, 70000, 5],
+        'copy': [0.5, np.nan, 2.25],
+        'gc': [0.1, 0.2, 0.3],
+    })
+    expected = df.copy()
+
+    compacted = compact_dtypes(df)
+
+    assert isinstance(compacted['cell_id'].dtype, pd.CategoricalDtype)
+    assert compacted['state'].dtype == np.int8
+    assert compacted['reads'].dtype == np.int32
+    assert compacted['copy'].dtype == np.float32
+    assert compacted['gc'].dtype == np.float64
+
+    for col in expected.columns:
+        pd.testing.assert_series_equal(compacted[col].astype(expected[col].dtype), expected[col])
+
+
+def test_compact_dtypes_keeps_other_strings():
+    """
+    Arrange: Build a frame with a string column not in CATEGORICAL_COLUMNS.
+    Act: Compact its dtypes.
+    Assert: The column is not made categorical.
+    """
+    df = pd.DataFrame({'cell_id': ['a', 'b'], 'is_contaminated': ['true', 'false']})
+
+    compacted = compact_dtypes(df)
+
+    assert not isinstance(compacted['is_contaminated'].dtype, pd.CategoricalDtype)
+
+
+def get_bins(cells, copies, states):
+    return compact_dtypes(pd.DataFrame({
+        'cell_id': cells,
+        'chr': ['1'] * len(cells),
+        'start': [1] * len(cells),
+        'copy': copies,
+        'state': states,
+    }))
+
+
+def test_cell_hashes_unchanged_when_cell_added():
+    """
+    Arrange: Build bins of two cells, then add a cell whose values widen the compacted dtypes.
+    Act: Hash the cells of both frames.
+    Assert: The first two cells keep their hashes.
+    """
+    before = get_bins(['a', 'a', 'b'], [0.5, 1.5, 2.0], [1, 2, 2])
+    after = get_bins(['a', 'a', 'b', 'c'], [0.5, 1.5, 2.0, 0.1], [1, 2, 2, 300])
+
+    assert before['copy'].dtype != after['copy'].dtype
+    assert before['state'].dtype != after['state'].dtype
+
+    before_hashes = get_cell_hashes(before)
+    after_hashes = get_cell_hashes(after)
+
+    assert after_hashes['a'] == before_hashes['a']
+    assert after_hashes['b'] == before_hashes['b']
+    assert 'c' in after_hashes
+
+
+def test_cell_hashes_independent_of_row_order():
+    """
+    Arrange: Build bins, and the same bins in another row order.
+    Act: Hash the cells of both frames.
+    Assert: Hashes are equal, and change when a value of a cell changes.
+    """
+    df = get_bins(['a', 'a', 'b'], [0.5, 1.5, 2.0], [1, 2, 2])
+    shuffled = df.iloc[[2, 1, 0]]
+    changed = get_bins(['a', 'a', 'b'], [0.5, 1.5, 3.0], [1, 2, 2])
+
+    assert get_cell_hashes(shuffled) == get_cell_hashes(df)
+    assert get_cell_hashes(changed)['a'] == get_cell_hashes(df)['a']
+    assert get_cell_hashes(changed)['b'] != get_cell_hashes(df)['b']
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule:: test_memory
+
+Tests of load batches sized by a memory budget.
+"""
+import pandas as pd
+
+from alhenaloader.memory import MemoryBudget, iter_batches, get_rss
+
+MB = 1024 ** 2
+
+
+def get_df(n):
+    return pd.DataFrame({'cell_id': [f'cell_{i % 10}' for i in range(n)], 'copy': [float(i) for i in range(n)]})
+
+
+def test_batch_size_uses_fraction_of_headroom():
+    """
+    Arrange: Create a budget.
+    Act: Get batch sizes for rows of different widths.
+    Assert: Batches use half of the headroom, so wider rows give smaller batches.
+    """
+    budget = MemoryBudget(1000 * MB)
+
+    assert budget.get_batch_size(100, 100 * MB) == int(50 * MB / 100)
+    assert budget.get_batch_size(1000, 100 * MB) == int(50 * MB / 1000)
+
+
+def test_batch_size_is_bounded(capsys):
+    """
+    Arrange: Create a budget.
+    Act: Get batch sizes with no headroom, twice, and with a lot of headroom.
+    Assert: Sizes are clamped to the bounds, and the warning is shown once.
+    """
+    budget = MemoryBudget(1000 * MB)
+
+    assert budget.get_batch_size(100, -10 * MB) == MemoryBudget.MIN_BATCH_SIZE
+    assert budget.get_batch_size(100, 0) == MemoryBudget.MIN_BATCH_SIZE
+    assert budget.get_batch_size(1, 1000 * MB) == MemoryBudget.MAX_BATCH_SIZE
+
+    assert capsys.readouterr().out.count('close to the limit') == 1
+
+
+def test_bytes_per_row_grows_with_width():
+    """
+    Arrange: Build a narrow and a wide frame.
+    Act: Measure their bytes per row.
+    Assert: The wide frame costs more per row.
+    """
+    budget = MemoryBudget(1000 * MB)
+    narrow = get_df(100)
+    wide = narrow.assign(**{f'metric_{i}': 1.5 for i in range(20)})
+
+    assert budget.get_bytes_per_row(wide) > budget.get_bytes_per_row(narrow)
+
+
+def test_iter_batches_covers_frame(monkeypatch):
+    """
+    Arrange: Create a budget with headroom for batches of about 1000 rows.
+    Act: Split a frame into batches.
+    Assert: Batches cover every row once, in order.
+    """
+    monkeypatch.setattr('alhenaloader.memory.get_rss', lambda: 0)
+    df = get_df(5000)
+
+    budget = MemoryBudget(0)
+    budget.max_bytes = 2 * 1000 * budget.get_bytes_per_row(df)
+
+    batches = list(iter_batches(df, int(1e5), budget))
+
+    assert len(batches) > 1
+    pd.testing.assert_frame_equal(pd.concat(batches), df)
+
+
+def test_iter_batches_halves_near_budget(monkeypatch, capsys):
+    """
+    Arrange: Start a load with headroom, then report memory above the high-water mark but under the budget.
+    Act: Split a frame into batches.
+    Assert: Batches are halved down to the minimum, with one warning.
+    """
+    rss = iter([0, 0] + [950 * MB] * 1000)
+    monkeypatch.setattr('alhenaloader.memory.get_rss', lambda: next(rss))
+
+    budget = MemoryBudget(1000 * MB)
+    monkeypatch.setattr(budget, 'get_bytes_per_row', lambda df: 500 * MB // 2000)
+
+    sizes = [batch.shape[0] for batch in budget.iter_batches(get_df(20000))]
+
+    assert sizes[:4] == [2000, 1000, 500, 500]
+    assert capsys.readouterr().out.count('close to the limit') == 1
+
+
+def test_iter_batches_keeps_size_below_high_water(monkeypatch):
+    """
+    Arrange: Report memory just under the high-water mark throughout a load.
+    Act: Split a frame into batches.
+    Assert: Batches keep the size set when the frame started loading.
+    """
+    monkeypatch.setattr('alhenaloader.memory.get_rss', lambda: 0)
+    budget = MemoryBudget(1000 * MB)
+    monkeypatch.setattr(budget, 'get_bytes_per_row', lambda df: 500 * MB // 2000)
+
+    batches = budget.iter_batches(get_df(6000))
+    first = next(batches)
+    monkeypatch.setattr('alhenaloader.memory.get_rss', lambda: 850 * MB)
+
+    assert [first.shape[0]] + [batch.shape[0] for batch in batches] == [2000, 2000, 2000]
+
+
+def test_fixed_batches_without_budget():
+    """
+    Arrange/Act: Split a frame without a budget.
+    Assert: Batches have the fixed batch size.
+    """
+    sizes = [batch.shape[0] for batch in iter_batches(get_df(2500), 1000)]
+
+    assert sizes == [1000, 1000, 500]
+
+
+def test_get_rss_is_positive():
+    """
+    Act: Get the resident set size of the test process.
+    Assert: It is positive, with or without psutil.
+    """
+    assert get_rss() > 0
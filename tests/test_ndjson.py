@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule:: test_ndjson
+
+Tests of the offline NDJSON bulk export and its replay.
+"""
+import glob
+import json
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from alhenaloader.api import get_records
+from alhenaloader.ndjson import BulkExporter, read_bulk_bodies, replay
+
+
+def get_df(n):
+    return pd.DataFrame({
+        'cell_id': [f'cell_{i}' for i in range(n)],
+        'copy': [np.nan if i % 3 == 0 else float(i) for i in range(n)],
+    })
+
+
+def read_index(directory, index, chunk_size=2):
+    """Return documents and bodies of exported index"""
+    bodies = [body for path in sorted(glob.glob(os.path.join(directory, index, "*.ndjson.gz")))
+              for body in read_bulk_bodies(path, chunk_size)]
+
+    lines = [json.loads(line) for body in bodies for line in body.splitlines()]
+    assert all(action == {"index": {"_index": index}} for action in lines[0::2])
+
+    return lines[1::2], bodies
+
+
+def read_bulk_bodies_docs(path):
+    return [line for body in read_bulk_bodies(path, 100) for line in body.splitlines()][1::2]
+
+
+class FakeES(object):
+    """Records what replay writes instead of sending it to Elasticsearch"""
+
+    ANALYSIS_ENTRY_INDEX = "analyses"
+
+    def __init__(self):
+        self.es = SimpleNamespace(indices=SimpleNamespace(exists=lambda index: False))
+        self.indices = {}
+        self.aliases = {}
+        self.records = {}
+        self.projects = None
+
+    def create_index(self, index, mapping=None):
+        self.indices[index] = []
+
+    def create_shared_alias(self, shared_index, alias, analysis_id, mapping=None):
+        self.aliases[alias] = (shared_index, analysis_id)
+        self.indices[alias] = []
+
+    def load_bulk_bodies(self, bodies):
+        num_records = 0
+        for body in bodies:
+            lines = body.splitlines()
+            index = json.loads(lines[0])["index"]["_index"]
+            self.indices[index].extend(json.loads(line) for line in lines[1::2])
+            num_records += len(lines) // 2
+        return num_records
+
+    def save_cell_hashes(self, analysis_id, cell_hashes):
+        self.records['cell_hashes'] = cell_hashes
+
+    def save_summaries(self, analysis_id, summaries):
+        self.records['summaries'] = summaries
+
+    def load_record(self, record, record_id, index):
+        self.records[index] = record
+
+    def get_missing_labels(self):
+        return []
+
+    def add_analysis_to_projects(self, analysis_id, projects):
+        self.projects = projects
+
+
+def test_export_round_trip_rolls_over_shards(tmp_path):
+    """
+    Arrange: Create an exporter with shards of 3 documents.
+    Act: Export 7 rows in two calls, then read them back in bodies of 2 documents.
+    Assert: Documents match the records of the rows, in shards of 3, 3 and 1.
+    """
+    exporter = BulkExporter(str(tmp_path), shard_size=3)
+    df = get_df(7)
+
+    exporter.load_df(df.iloc[:4], 'a1_qc', batch_size=2)
+    exporter.load_df(df.iloc[4:], 'a1_qc')
+
+    shards = sorted(glob.glob(os.path.join(str(tmp_path), 'a1_qc', '*.ndjson.gz')))
+    assert [len(read_bulk_bodies_docs(path)) for path in shards] == [3, 3, 1]
+
+    documents, bodies = read_index(str(tmp_path), 'a1_qc')
+    assert documents == get_records(get_df(7))
+    assert max(len(body.splitlines()) for body in bodies) == 4
+
+
+def export_analysis(directory, qc_count=5):
+    exporter = BulkExporter(directory)
+
+    exporter.load_df(get_df(5), 'a1_qc')
+    exporter.create_shared_alias('alhena_segs', 'a1_segs', 'A1')
+    exporter.load_df(get_df(3), 'a1_segs')
+    exporter.save_cell_hashes('A1', {'qc': {'cell_0': '0'}})
+    exporter.save_summaries('A1', {'qc': {'cell_count': 5}})
+
+    record = {'dashboard_id': 'A1', 'load_stats': {'qc': {'count': qc_count}, 'segs': {'count': 3}}}
+    exporter.write_analysis('A1', record, ['DLP'])
+
+
+def test_replay_loads_indices_aliases_and_records(tmp_path):
+    """
+    Arrange: Export an analysis with an index, a shared index alias, hashes and summaries.
+    Act: Replay it.
+    Assert: Documents, the alias, side records and the analysis record are loaded.
+    """
+    export_analysis(str(tmp_path))
+    es = FakeES()
+
+    replay(str(tmp_path), es, chunk_size=2)
+
+    assert es.indices['a1_qc'] == get_records(get_df(5))
+    assert es.indices['a1_segs'] == get_records(get_df(3))
+    assert es.aliases == {'a1_segs': ('alhena_segs', 'A1')}
+    assert es.records['cell_hashes'] == {'qc': {'cell_0': '0'}}
+    assert es.records['summaries'] == {'qc': {'cell_count': 5}}
+    assert es.records['analyses']['dashboard_id'] == 'A1'
+    assert es.projects == ['DLP']
+
+
+def test_replay_raises_on_count_mismatch(tmp_path):
+    """
+    Arrange: Export an analysis whose load statistics expect more qc records than were written.
+    Act/Assert: Replaying it raises before the analysis is registered.
+    """
+    export_analysis(str(tmp_path), qc_count=6)
+    es = FakeES()
+
+    with pytest.raises(ValueError):
+        replay(str(tmp_path), es)
+
+    assert 'analyses' not in es.records
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule:: test_projects
+
+Tests of declarative project membership.
+"""
+from types import SimpleNamespace
+
+import pytest
+
+from alhenaloader.api import ES
+
+
+class FakeSecurity(object):
+    """Project roles kept in memory, recording writes"""
+
+    def __init__(self, roles):
+        self.roles = roles
+        self.puts = []
+        self.deletes = []
+
+    def get_role(self, name=None):
+        return dict(self.roles)
+
+    def put_role(self, name, body):
+        self.puts.append((name, sorted(body['indices'][0]['names'])))
+
+    def delete_role(self, name):
+        self.deletes.append(name)
+
+
+def get_role(*analyses):
+    return {'indices': [{'names': ['analyses'] + list(analyses), 'privileges': ['read']}]}
+
+
+def get_es(roles, loaded=('A1', 'A2', 'A3')):
+    es = ES.__new__(ES)
+    es.es = SimpleNamespace(security=FakeSecurity(roles))
+    es.get_analyses = lambda: [{'dashboard_id': analysis} for analysis in loaded]
+    return es
+
+
+ROLES = {
+    'same_dashboardReader': get_role('A1'),
+    'changed_dashboardReader': get_role('A1', 'A2'),
+    'extra_dashboardReader': get_role('A3'),
+    'superuser': get_role(),
+}
+
+
+def test_sync_creates_updates_and_skips():
+    """
+    Arrange: Fake roles of projects, one of them matching the desired analyses.
+    Act: Sync desired projects.
+    Assert: Only the new and the changed project are written, and no project is removed.
+    """
+    es = get_es(dict(ROLES))
+
+    to_put, to_delete = es.sync_projects({'same': ['A1'], 'changed': ['A2', 'A3'], 'new': ['A1']})
+
+    assert to_put == {'changed': ['A2', 'A3'], 'new': ['A1']}
+    assert to_delete == []
+    assert sorted(es.es.security.puts) == [
+        ('changed_dashboardReader', ['A2', 'A3', 'analyses']),
+        ('new_dashboardReader', ['A1', 'analyses']),
+    ]
+    assert es.es.security.deletes == []
+
+
+def test_sync_prunes_only_projects():
+    """
+    Arrange: Fake roles including a project missing from desired and a role that is not a project.
+    Act: Sync with prune.
+    Assert: Only the missing project is removed.
+    """
+    es = get_es(dict(ROLES))
+
+    to_put, to_delete = es.sync_projects({'same': ['A1'], 'changed': ['A1', 'A2']}, prune=True)
+
+    assert to_put == {}
+    assert to_delete == ['extra']
+    assert es.es.security.deletes == ['extra_dashboardReader']
+
+
+def test_sync_dry_run_makes_no_writes():
+    """
+    Arrange: Fake roles that differ from desired projects.
+    Act: Sync with dry run and prune.
+    Assert: Changes are returned, but no role is written or removed.
+    """
+    es = get_es(dict(ROLES))
+
+    to_put, to_delete = es.sync_projects({'new': ['A1']}, prune=True, dry_run=True)
+
+    assert to_put == {'new': ['A1']}
+    assert to_delete == ['changed', 'extra', 'same']
+    assert es.es.security.puts == []
+    assert es.es.security.deletes == []
+
+
+def test_sync_rejects_unloaded_analyses():
+    """
+    Arrange/Act: Sync a project with an analysis that is not loaded.
+    Assert: It raises before writing any role.
+    """
+    es = get_es(dict(ROLES))
+
+    with pytest.raises(AssertionError, match='A9'):
+        es.sync_projects({'new': ['A1', 'A9']})
+
+    assert es.es.security.puts == []
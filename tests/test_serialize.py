@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule:: test_serialize
+
+Tests of bulk bodies serialized in worker processes.
+"""
+import json
+
+import numpy as np
+import pandas as pd
+from elasticsearch.serializer import JSONSerializer
+
+from alhenaloader.api import get_records
+from alhenaloader.serialize import serialize_df
+
+
+def get_df():
+    return pd.DataFrame({
+        'cell_id': pd.Categorical([f'cell_{i}' for i in range(8)]),
+        'chrom_number': pd.Categorical(['01', '01', 'X', None, '02', 'X', '01', '02']),
+        'state': np.arange(8, dtype=np.int8),
+        'copy': [0.5, np.nan, 1.5, 2.0, np.nan, 3.25, 1.0, 0.0],
+        'is_contaminated': ['true', 'false'] * 4,
+        'time': pd.to_datetime(['2021-01-01 00:00:00'] * 4 + ['2021-06-01 12:30:00'] * 4),
+    })
+
+
+def test_serialize_df_matches_records():
+    """
+    Arrange: Build a frame with categoricals, missing values and timestamps.
+    Act: Serialize it in two worker processes, 3 rows per body.
+    Assert: Bodies index every row into the index, with the documents of the threaded path.
+    """
+    df = get_df()
+    serializer = JSONSerializer()
+    expected = [json.loads(serializer.dumps(record)) for record in get_records(get_df())]
+
+    bodies = list(serialize_df(df, 'idx', 2, rows_per_body=3))
+
+    lines = [json.loads(line) for body in bodies for line in body.splitlines()]
+    assert sorted(len(body.splitlines()) // 2 for body in bodies) == [2, 3, 3]
+    assert all(action == {"index": {"_index": "idx"}} for action in lines[0::2])
+
+    documents = sorted(lines[1::2], key=lambda document: document['cell_id'])
+    assert documents == expected
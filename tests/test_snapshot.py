@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule:: test_snapshot
+
+Tests of restoring analysis snapshots.
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from alhenaloader.api import get_records
+from alhenaloader.snapshot import read_bulk_bodies
+
+
+def get_page(start, n):
+    return pd.DataFrame({
+        'cell_id': [f'cell_{i}' for i in range(start, start + n)],
+        'copy': [np.nan if i % 2 else float(i) for i in range(start, start + n)],
+    })
+
+
+def test_read_bulk_bodies_streams_all_pages(tmp_path):
+    """
+    Arrange: Write two parquet pages of an exported index.
+    Act: Read them as bulk bodies of 2 actions.
+    Assert: One stream of bodies indexes every row of both pages, in order.
+    """
+    paths = []
+    for page, (start, n) in enumerate([(0, 3), (3, 2)]):
+        path = os.path.join(str(tmp_path), f"slice-000-{page:06d}.parquet")
+        get_page(start, n).to_parquet(path)
+        paths.append(path)
+
+    bodies = list(read_bulk_bodies(paths, 'a1_qc', chunk_size=2))
+
+    lines = [json.loads(line) for body in bodies for line in body.splitlines()]
+    assert [len(body.splitlines()) // 2 for body in bodies] == [2, 1, 2]
+    assert all(action == {"index": {"_index": "a1_qc"}} for action in lines[0::2])
+    assert lines[1::2] == get_records(get_page(0, 5))
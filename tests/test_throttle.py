@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule:: test_throttle
+
+Tests of the ingest rate limits.
+"""
+import pytest
+from elasticsearch.serializer import JSONSerializer
+
+from alhenaloader.throttle import TokenBucket, Throttle, get_bulk_size
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr('alhenaloader.throttle.time.monotonic', clock)
+    return clock
+
+
+def test_token_bucket_waits_for_deficit(clock):
+    """
+    Arrange: Create a bucket of 100 tokens per second.
+    Act: Take its capacity, then more tokens.
+    Assert: Only the tokens beyond capacity wait, for as long as they take to refill.
+    """
+    bucket = TokenBucket(100)
+
+    assert bucket.reserve(100) == 0.0
+    assert bucket.reserve(50) == pytest.approx(0.5)
+
+
+def test_token_bucket_refills_up_to_capacity(clock):
+    """
+    Arrange: Empty a bucket of 100 tokens per second.
+    Act: Let time pass beyond a full refill.
+    Assert: The bucket refills to its capacity but no further.
+    """
+    bucket = TokenBucket(100)
+    bucket.reserve(100)
+
+    clock.now = 10.0
+
+    assert bucket.reserve(100) == 0.0
+    assert bucket.reserve(100) == pytest.approx(1.0)
+
+
+def test_token_bucket_factor_slows_refill(clock):
+    """
+    Arrange/Act: Take tokens beyond capacity with the refill rate halved.
+    Assert: The wait is twice as long.
+    """
+    bucket = TokenBucket(100)
+    bucket.reserve(100)
+
+    assert bucket.reserve(50, 0.5) == pytest.approx(1.0)
+
+
+def test_throttle_waits_for_slowest_ceiling(clock):
+    """
+    Arrange: Create a throttle with document and byte ceilings.
+    Act: Reserve a request beyond the byte ceiling.
+    Assert: The wait is set by the byte ceiling.
+    """
+    throttle = Throttle(docs_per_sec=1000, bytes_per_sec=1000)
+    throttle.reserve(1000, 1000)
+
+    assert throttle.reserve(10, 2000) == pytest.approx(2.0)
+
+
+def test_adaptive_throttle_backs_off_and_recovers():
+    """
+    Arrange: Create an adaptive throttle.
+    Act: Observe slow then fast bulk requests.
+    Assert: The ceilings are lowered, then recover to at most their configured value.
+    """
+    throttle = Throttle(docs_per_sec=1000, adaptive=True, target_latency=1.0)
+
+    throttle.observe_latency(5.0)
+    assert throttle.factor == pytest.approx(Throttle.BACKOFF)
+
+    for i in range(100):
+        throttle.observe_latency(0.1)
+    assert throttle.factor == 1.0
+
+
+def test_queue_backoff_holds_through_fast_bulks():
+    """
+    Arrange: Create an adaptive throttle.
+    Act: Report a deep write queue on every poll, with fast bulk requests in between.
+    Assert: Fast bulks do not undo the backoff, so the ceilings keep falling.
+    """
+    throttle = Throttle(docs_per_sec=1000, adaptive=True, target_latency=1.0, max_queue=50)
+
+    for poll in range(3):
+        throttle.observe_queue(500)
+        for i in range(10):
+            throttle.observe_latency(0.1)
+
+    assert throttle.factor == pytest.approx(Throttle.BACKOFF ** 3)
+
+    throttle.observe_queue(0)
+    throttle.observe_latency(0.1)
+    assert throttle.factor == pytest.approx(Throttle.BACKOFF ** 3 * Throttle.RECOVERY ** 2)
+
+
+def test_bulk_size_counts_actions_and_sources():
+    """
+    Arrange/Act: Get the size of a bulk body for two records.
+    Assert: It counts an action and a source line per record, in UTF-8 bytes.
+    """
+    serializer = JSONSerializer()
+    records = [{'a': 1}, {'b': 'é'}]
+
+    body = "".join(serializer.dumps({"index": {"_index": "i"}}) + "\n" + serializer.dumps(record) + "\n"
+                   for record in records)
+
+    assert get_bulk_size(serializer, records, 'i') == len(body.encode('utf-8'))
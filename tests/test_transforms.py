@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule:: test_transforms
+
+Tests of the declarative dataframe transforms.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from alhenaloader.load import get_qc_data, get_segs_data, chr_prefixed
+from alhenaloader.transforms import BoolToKeyword, remap_categories
+
+
+def get_metrics():
+    return pd.DataFrame({
+        'cell_id': ['a', 'b', 'c'],
+        'unmapped_reads': [10, 0, 5],
+        'total_reads': [100, 50, 0],
+        'is_contaminated': [True, False, True],
+        'clustering_order': [2, 1, 3],
+        'condition': ['A', 'B', 'A'],
+    })
+
+
+def get_qc_data_reference(data, framework):
+    """get_qc_data before transforms were declarative"""
+    if framework == 'mondrian':
+        data.rename(columns={'clustering_order': 'order', 'condition': 'experimental_condition'}, inplace=True)
+
+    data['percent_unmapped_reads'] = data["unmapped_reads"] / data["total_reads"]
+    data['is_contaminated'] = data['is_contaminated'].apply(
+        lambda a: {True: 'true', False: 'false'}[a])
+    return data
+
+
+@pytest.mark.parametrize("framework,source", [('scp', 'annotation_metrics'), ('mondrian', 'hmmcopy_metrics')])
+def test_qc_transforms_match_reference(framework, source):
+    """
+    Arrange: Build metrics for a framework.
+    Act: Get qc data with QC_TRANSFORMS and with the reference implementation.
+    Assert: Both give the same values.
+    """
+    df = get_qc_data({source: get_metrics()}, framework)
+    expected = get_qc_data_reference(get_metrics(), framework)
+
+    assert list(df.columns) == list(expected.columns)
+    for col in expected.columns:
+        pd.testing.assert_series_equal(df[col].astype(expected[col].dtype), expected[col])
+
+
+def test_chrom_transforms_match_reference():
+    """
+    Arrange: Build segments with numbered and named chromosomes.
+    Act: Get segs data.
+    Assert: chrom_number zero pads single digit chromosomes and keeps the rest.
+    """
+    chromosomes = ['1', '9', '10', 'X', '1', 'Y']
+    df = get_segs_data({'hmmcopy_segs': pd.DataFrame({'chr': chromosomes})})
+
+    assert list(df['chrom_number']) == [chr_prefixed.get(chrom, chrom) for chrom in chromosomes]
+
+
+def test_remap_categories_keeps_missing_values():
+    """
+    Arrange: Build a series with missing values.
+    Act: Remap its values, mapping two values to the same one.
+    Assert: Values are mapped like Series.map and missing values stay missing.
+    """
+    series = pd.Series(['a', None, 'b', 'c', 'a'], name='letters')
+    mapping = {'a': 'x', 'b': 'x'}
+
+    remapped = remap_categories(series, mapping)
+
+    assert list(remapped.cat.categories) == ['c', 'x']
+    assert remapped.name == 'letters'
+    assert list(remapped.astype(object).fillna('missing')) == ['x', 'missing', 'x', 'c', 'x']
+
+
+def test_bool_to_keyword():
+    """
+    Arrange/Act: Convert a boolean column.
+    Assert: Values are 'true' and 'false' keywords.
+    """
+    df = BoolToKeyword('flag')(pd.DataFrame({'flag': [True, False, np.True_]}))
+
+    assert list(df['flag'].astype(object)) == ['true', 'false', 'true']
+
+
+@pytest.mark.parametrize("values", [[True, 'yes'], [True, None], [True, np.nan]])
+def test_bool_to_keyword_rejects_other_values(values):
+    """
+    Arrange: Build a column with a value that is not a boolean.
+    Act/Assert: Converting it raises, as the lookup it replaced did.
+    """
+    with pytest.raises(ValueError):
+        BoolToKeyword('flag')(pd.DataFrame({'flag': values}))
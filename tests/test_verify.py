@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule:: test_verify
+
+Tests of verifying loaded data against load-time statistics.
+"""
+from types import SimpleNamespace
+
+from alhenaloader.api import ES, get_verify_query, compare_load_stats
+
+EXPECTED = {'count': 100, 'cell_ids': 10, 'sums': {'copy': 250.0, 'state': 200.0}}
+
+
+def get_response(count=100, cell_ids=10, copy=250.0, state=200.0):
+    return {
+        'hits': {'total': {'value': count, 'relation': 'eq'}, 'hits': []},
+        'aggregations': {
+            'cell_ids': {'value': cell_ids},
+            'sum_copy': {'value': copy},
+            'sum_state': {'value': state},
+        },
+    }
+
+
+def test_verify_query_aggregates_statistics():
+    """
+    Arrange/Act: Build the query for load statistics.
+    Assert: It counts all hits exactly and aggregates cells and every summed field.
+    """
+    query = get_verify_query(EXPECTED)
+
+    assert query['size'] == 0
+    assert query['track_total_hits'] is True
+    assert query['aggs']['cell_ids']['cardinality']['field'] == 'cell_id'
+    assert query['aggs']['sum_copy'] == {'sum': {'field': 'copy'}}
+    assert query['aggs']['sum_state'] == {'sum': {'field': 'state'}}
+
+
+def test_matching_response_has_no_problems():
+    assert compare_load_stats('bins', EXPECTED, get_response()) == []
+
+
+def test_count_mismatch():
+    problems = compare_load_stats('bins', EXPECTED, get_response(count=99))
+
+    assert problems == ['bins: 99 documents, expected 100']
+
+
+def test_cardinality_mismatch():
+    problems = compare_load_stats('bins', EXPECTED, get_response(cell_ids=9))
+
+    assert problems == ['bins: 9 cells, expected 10']
+
+
+def test_sum_within_tolerance():
+    """
+    Arrange/Act: Compare a response whose sum differs only by float rounding.
+    Assert: No problem is reported.
+    """
+    assert compare_load_stats('bins', EXPECTED, get_response(copy=250.0 + 1e-7)) == []
+
+
+def test_sum_outside_tolerance():
+    problems = compare_load_stats('bins', EXPECTED, get_response(copy=250.5))
+
+    assert problems == ['bins: sum of copy is 250.5, expected 250.0']
+
+
+def test_error_response():
+    """
+    Arrange/Act: Compare an msearch error response, as for a missing index.
+    Assert: The error type is reported instead of comparing statistics.
+    """
+    response = {'error': {'type': 'index_not_found_exception'}, 'status': 404}
+
+    assert compare_load_stats('segs', EXPECTED, response) == ['segs: index_not_found_exception']
+
+
+def test_verify_analyses_pairs_responses():
+    """
+    Arrange: Fake two analyses, one without load statistics, and canned msearch responses.
+    Act: Verify all analyses.
+    Assert: Each response is compared with the statistics of its own analysis and data type.
+    """
+    analyses = [
+        {'dashboard_id': 'A1', 'load_stats': {'qc': EXPECTED, 'bins': EXPECTED}},
+        {'dashboard_id': 'A2'},
+    ]
+    searches = []
+
+    def msearch(body):
+        searches.append(body)
+        return {'responses': [get_response(), get_response(count=1)]}
+
+    es = ES.__new__(ES)
+    es.es = SimpleNamespace(msearch=msearch)
+    es.get_analyses = lambda: analyses
+
+    problems = es.verify_analyses()
+
+    assert [search['index'] for search in searches[0][0::2]] == ['a1_qc', 'a1_bins']
+    assert problems == {
+        'A1': ['bins: 1 documents, expected 100'],
+        'A2': ['no load statistics recorded'],
+    }